@@ -0,0 +1,493 @@
+import argparse, gc, json, os, platform, random, resource, shutil, subprocess, sys, tempfile, time, tracemalloc
+os.environ.setdefault("SDL_VIDEODRIVER", "dummy") # benchmarks never open a real window
+import numpy
+import pygame
+from game import World, Chunk, Entity, TickScheduler
+from constants import FrozenConstants as FC
+import worldgen, tileset, renderer, input, pathfind, fov, minimap
+from instrument import INSTRUMENTS
+
+BENCHMARKS = {} # Format: {name: func(args)}
+RESULTS = [] # Format: [{"benchmark", "metric", "value", "unit", "params"}] written by --json
+
+def record(benchmarkName: str, metric: str, value: float, unit: str, **params):
+    RESULTS.append({"benchmark": benchmarkName, "metric": metric, "value": value, "unit": unit, "params": params})
+
+def peak_rss_b() -> int:
+    # process wide high water mark, so later benchmarks in one run include earlier ones
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == "darwin" else peak * 1024 # bytes on macOS, KiB elsewhere
+
+def benchmark(name):
+    def register(func):
+        BENCHMARKS[name] = func
+        return func
+    return register
+
+class LegacyCell: # the pre-array layout, kept here only to compare against
+    def __init__(self, terrainID=1,passable=True):
+        self.entities = []
+        self.terrainID  = terrainID
+        self.passable = passable
+
+class LegacyChunk:
+    def __init__(self, sideLength_ux):
+        self.cells = [[[LegacyCell(random.randint(1, 2), True) for z in range(sideLength_ux)]
+                       for y in range(sideLength_ux)]
+                       for x in range(sideLength_ux)]
+
+def _measure_chunks(chunkFactory, chunkCount: int) -> tuple[float, int]:
+    gc.collect()
+    startTime = time.perf_counter()
+    chunks = [chunkFactory() for _ in range(chunkCount)]
+    elapsed_s = time.perf_counter() - startTime
+    del chunks
+
+    gc.collect()
+    tracemalloc.start()
+    chunks = [chunkFactory() for _ in range(chunkCount)]
+    memory_b = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del chunks
+    return elapsed_s, memory_b
+
+@benchmark("chunks")
+def bench_chunk_layouts(args):
+    # the legacy layout cannot fit a 32^3 world in memory, so large worlds are extrapolated from a sample
+    for sideLength_cx in args.sizes:
+        worldChunks = sideLength_cx ** 3
+        for layoutName, chunkFactory, limit in (
+                ("legacy cells", lambda: LegacyChunk(World.CHUNK_SIZE_UX), args.legacy_sample),
+                ("arrays", lambda: Chunk(World.CHUNK_SIZE_UX, *worldgen.generateChunk(0, (0, 0, 0), World.CHUNK_SIZE_UX)), args.array_sample)):
+            sampleChunks = min(worldChunks, limit)
+            elapsed_s, memory_b = _measure_chunks(chunkFactory, sampleChunks)
+            scale = worldChunks / sampleChunks
+            note = "" if scale == 1 else f" (extrapolated from {sampleChunks} chunks)"
+            print(f"{sideLength_cx}^3 chunks {layoutName:>12}: {elapsed_s*scale:9.3f} s {memory_b*scale/2**20:11.1f} MiB{note}")
+            record("chunks", "build_s", elapsed_s*scale, "s", side_cx=sideLength_cx, layout=layoutName)
+            record("chunks", "memory_MiB", memory_b*scale/2**20, "MiB", side_cx=sideLength_cx, layout=layoutName)
+
+def _headless_display() -> pygame.Surface:
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    pygame.init()
+    return pygame.display.set_mode(FC.DISPLAY_DIMENSIONS)
+
+def _headless_renderer(world: World) -> renderer.Renderer:
+    _headless_display()
+    tiles = tileset.load_tileset(FC.PLAY_TILES_FILENAME,FC.PLAY_TILES_DIMENSIONS)
+    return renderer.Renderer(pygame.Rect(FC.PLAY_AREA_TOPLEFT,FC.PLAY_AREA_DIMENSIONS), tiles, world, FC.ZOOM_SCALES, FC.RENDER_CACHE_BUDGET_MB*2**20)
+
+def _all_chunk_keys(world: World) -> list[tuple[int, int, int]]:
+    return [(cx, cy, cz) for cz in range(world.depth_chunks) for cy in range(world.height_chunks) for cx in range(world.width_chunks)]
+
+def _percentile(samples: list[float], fraction: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+@benchmark("raster")
+def bench_chunk_raster(args):
+    # cold rasterization only, the surface cache is emptied before every chunk
+    world = World(seed=0)
+    rRenderer = _headless_renderer(world)
+    chunkKeys = [(cx, cy, 0) for cx in range(world.width_chunks) for cy in range(world.height_chunks)]
+    for coords_cx in chunkKeys:
+        world.getChunkFromCX(coords_cx)
+    for zoom in FC.ZOOM_SCALES:
+        rRenderer.zoom = zoom
+        rendered = 0
+        startTime = time.perf_counter()
+        while rendered < args.raster_chunks:
+            coords_cx = chunkKeys[rendered % len(chunkKeys)]
+            rRenderer.surface_cache.clear()
+            rRenderer._render_single_chunk(coords_cx)
+            rendered += 1
+        elapsed_s = time.perf_counter() - startTime
+        print(f"zoom {zoom}: {rendered/elapsed_s:9.1f} chunks/s")
+        record("raster", "chunks_per_s", rendered/elapsed_s, "chunks/s", zoom=zoom)
+
+@benchmark("tick")
+def bench_tick(args):
+    # random steps for every entity, resolved per entity through Entity.move and as one TickScheduler batch
+    steps = [(dx, dy, 0) for dx in (-1, 0, 1) for dy in (-1, 0, 1) if dx or dy]
+    for entityCount in args.entities:
+        world = World(seed=0)
+        rng = random.Random(0)
+        entities = [
+            Entity(world, f"npc {i}", 3, (rng.randrange(world.dimensions_ux[0]), rng.randrange(world.dimensions_ux[1]), rng.randrange(world.chunk_size_ux)))
+            for i in range(entityCount)
+        ]
+        startTime = time.perf_counter()
+        for entity in entities:
+            entity.move(*rng.choice(steps))
+        perEntity_s = time.perf_counter() - startTime
+
+        scheduler = TickScheduler(world)
+        startTime = time.perf_counter()
+        for entity in entities:
+            scheduler.queueMove(entity, *rng.choice(steps))
+        applied = scheduler.tick()
+        batched_s = time.perf_counter() - startTime
+        print(f"{entityCount:>7} entities: Entity.move {entityCount/perEntity_s:10.0f} moves/s, TickScheduler {entityCount/batched_s:10.0f} moves/s ({applied} applied)")
+        record("tick", "entity_move_per_s", entityCount/perEntity_s, "moves/s", entities=entityCount)
+        record("tick", "scheduler_move_per_s", entityCount/batched_s, "moves/s", entities=entityCount)
+
+@benchmark("world")
+def bench_world(args):
+    # construction is lazy, generating every chunk is where the time goes
+    startTime = time.perf_counter()
+    world = World(seed=0)
+    construct_s = time.perf_counter() - startTime
+    world.chunks.budget_chunks = len(_all_chunk_keys(world)) # nothing evicted while measuring generation
+    startTime = time.perf_counter()
+    for coords_cx in _all_chunk_keys(world):
+        world.getChunkFromCX(coords_cx)
+    generate_s = time.perf_counter() - startTime
+    print(f"World() {construct_s*1000:9.3f} ms, generating {len(world.chunks)} chunks {generate_s:7.3f} s")
+    record("world", "construct_ms", construct_s*1000, "ms")
+    record("world", "generate_all_s", generate_s, "s", chunks=len(world.chunks))
+
+@benchmark("persist")
+def bench_persist(args):
+    # every chunk dirty, as after a long session, then read back cold through a fresh World
+    world = World(seed=0)
+    chunkKeys = _all_chunk_keys(world)
+    world.chunks.budget_chunks = len(chunkKeys)
+    for coords_cx in chunkKeys:
+        world.getChunkFromCX(coords_cx).dirty = True
+    directory = tempfile.mkdtemp(prefix="doodoo-bench-")
+    try:
+        path = os.path.join(directory, FC.WORLD_DIRNAME)
+        startTime = time.perf_counter()
+        world.save(path)
+        save_s = time.perf_counter() - startTime
+        for coords_cx in chunkKeys:
+            world.getChunkFromCX(coords_cx).dirty = True
+        startTime = time.perf_counter()
+        world.save(path, background=True)
+        backgroundBlock_s = time.perf_counter() - startTime
+        world.pending_saves[-1][0].result()
+        backgroundTotal_s = time.perf_counter() - startTime
+        world.pollSaves()
+        world.store.close()
+        size_b = sum(os.path.getsize(os.path.join(root, name)) for root, dirs, names in os.walk(path) for name in names)
+
+        startTime = time.perf_counter()
+        loaded = World.load(path, len(chunkKeys))
+        load_s = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        for coords_cx in chunkKeys:
+            loaded.getChunkFromCX(coords_cx)
+        page_s = time.perf_counter() - startTime
+        loaded.store.close()
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+    print(f"save {len(chunkKeys)} chunks {save_s:7.3f} s ({size_b/2**20:.1f} MiB), load {load_s*1000:8.2f} ms, page in every chunk {page_s:7.3f} s")
+    print(f"background save blocks the caller {backgroundBlock_s*1000:8.2f} ms of {backgroundTotal_s*1000:8.2f} ms")
+    record("persist", "save_s", save_s, "s", chunks=len(chunkKeys))
+    record("persist", "background_save_block_ms", backgroundBlock_s*1000, "ms", chunks=len(chunkKeys))
+    record("persist", "background_save_total_ms", backgroundTotal_s*1000, "ms", chunks=len(chunkKeys))
+    record("persist", "size_MiB", size_b/2**20, "MiB", chunks=len(chunkKeys))
+    record("persist", "load_ms", load_s*1000, "ms")
+    record("persist", "page_in_all_s", page_s, "s", chunks=len(chunkKeys))
+
+@benchmark("render")
+def bench_render(args):
+    # cold: empty surface cache and view buffer, warm: chunk surfaces cached but the view rebuilt, steady: nothing changed
+    world = World(seed=0)
+    rRenderer = _headless_renderer(world)
+    target = pygame.display.get_surface()
+    center_ux = FC.PLAYER_SPAWN_COORDS_ux
+    for zoom in FC.ZOOM_SCALES:
+        rRenderer.zoom = zoom
+        timings = {"cold": [], "warm": [], "steady": []}
+        for _ in range(args.render_frames):
+            rRenderer.surface_cache.clear()
+            rRenderer.view_buffer = None
+            for phase in ("cold", "warm", "steady"):
+                if phase == "warm":
+                    rRenderer.view_buffer = None
+                startTime = time.perf_counter()
+                rRenderer.render(center_ux, target=target)
+                timings[phase].append(time.perf_counter() - startTime)
+        print(f"zoom {zoom}: " + ", ".join(f"{phase} {min(samples)*1000:8.2f} ms" for phase, samples in timings.items()))
+        for phase, samples in timings.items():
+            record("render", f"{phase}_ms", min(samples)*1000, "ms", zoom=zoom)
+
+@benchmark("walk")
+def bench_walk(args):
+    # the main loop without a window: every keydown goes through InputHandler and redraws when it asks to
+    world = World(seed=0)
+    rRenderer = _headless_renderer(world)
+    display = pygame.display.get_surface()
+    player = Entity(world, FC.PLAYER_ENTITY_NAME, 3, FC.PLAYER_SPAWN_COORDS_ux)
+    handler = input.InputHandler(player, world, rRenderer)
+    playRect = rRenderer.bounds
+    legs = [pygame.K_d, pygame.K_s, pygame.K_a, pygame.K_w, pygame.K_c, pygame.K_q] # out and back along a square and a diagonal
+    keys = [key for key in legs for _ in range(args.walk_steps)] + [pygame.K_EQUALS]*3 + [key for key in legs for _ in range(args.walk_steps // 4)]
+    frames_s = []
+    startTime = time.perf_counter()
+    for key in keys:
+        frameStart = time.perf_counter()
+        if handler.handleKeydown(key):
+            world.pinAround(player.coordinates_ux, FC.WORLD_PINNED_RADIUS_cx)
+            display.fill((0,0,0),playRect)
+            rRenderer.render(player.coordinates_ux, player.last_move_ux, display)
+            pygame.display.flip()
+        frames_s.append(time.perf_counter() - frameStart)
+    elapsed_s = time.perf_counter() - startTime
+    print(f"{len(keys)} keys {elapsed_s:7.3f} s, mean {elapsed_s/len(keys)*1000:7.2f} ms, p95 {_percentile(frames_s, 0.95)*1000:7.2f} ms, max {max(frames_s)*1000:7.2f} ms")
+    record("walk", "mean_frame_ms", elapsed_s/len(keys)*1000, "ms", keys=len(keys))
+    record("walk", "p95_frame_ms", _percentile(frames_s, 0.95)*1000, "ms", keys=len(keys))
+    record("walk", "max_frame_ms", max(frames_s)*1000, "ms", keys=len(keys))
+
+@benchmark("path")
+def bench_path(args):
+    # random start and goal pairs on a layer with a quarter of its cells walled off, the cold pass builds every
+    # cluster it touches and the warm pass repeats the same queries against the cached ones
+    for sideLength_cx in args.sizes:
+        # at the game's residency budget with a store, walled chunks are written back and paged in again as queries wander
+        directory = tempfile.mkdtemp(prefix="doodoo-bench-")
+        world = World(sideLength_cx, sideLength_cx, sideLength_cx, resident_chunks=FC.WORLD_RESIDENT_CHUNKS, seed=0)
+        try:
+            world.save(os.path.join(directory, FC.WORLD_DIRNAME))
+            chunkSize_ux = world.chunk_size_ux
+            walls = numpy.random.default_rng(0)
+            for cy in range(sideLength_cx):
+                for cx in range(sideLength_cx):
+                    for y, x in numpy.argwhere(walls.random((chunkSize_ux, chunkSize_ux)) < 0.25).tolist():
+                        world.getCell((cx*chunkSize_ux + x, cy*chunkSize_ux + y, 0)).passable = False # an edit like the game's, saved when evicted
+            rng = random.Random(0)
+            def openCell():
+                while True:
+                    coords_ux = (rng.randrange(world.dimensions_ux[0]), rng.randrange(world.dimensions_ux[1]), 0)
+                    if world.getCell(coords_ux).passable:
+                        return coords_ux
+            pairs = [(openCell(), openCell()) for _ in range(args.path_queries)]
+            pathfinder = pathfind.Pathfinder(world)
+            for phase in ("cold", "warm"):
+                buildsBefore = pathfinder.cluster_builds
+                startTime = time.perf_counter()
+                found = sum(pathfinder.findPath(start_ux, goal_ux) is not None for start_ux, goal_ux in pairs)
+                elapsed_s = time.perf_counter() - startTime
+                print(f"{sideLength_cx}^3 {phase}: {len(pairs)/elapsed_s:9.1f} paths/s ({found} found, {pathfinder.cluster_builds - buildsBefore} clusters built, {world.chunks.evictions} chunk evictions so far)")
+                record("path", f"{phase}_paths_per_s", len(pairs)/elapsed_s, "paths/s", side_cx=sideLength_cx)
+                record("path", f"{phase}_cluster_builds", pathfinder.cluster_builds - buildsBefore, "clusters", side_cx=sideLength_cx)
+
+            # one flow field shared by everything in its window heading to the same goal
+            goal_ux = pairs[0][1]
+            startTime = time.perf_counter()
+            flowField = pathfinder.flowField(goal_ux)
+            build_s = time.perf_counter() - startTime
+            followers = [coords_ux for coords_ux in (openCell() for _ in range(args.path_queries*10)) if flowField.distance(coords_ux)]
+            startTime = time.perf_counter()
+            flowField = pathfinder.flowField(goal_ux) # looked up once per tick, checks every chunk of the window is unchanged
+            for coords_ux in followers:
+                flowField.step(coords_ux)
+            step_s = time.perf_counter() - startTime
+            print(f"{sideLength_cx}^3 flow field: built in {build_s*1000:7.2f} ms, {len(followers)/step_s:9.0f} steps/s")
+            record("path", "flow_field_build_ms", build_s*1000, "ms", side_cx=sideLength_cx)
+            record("path", "flow_steps_per_s", len(followers)/step_s, "steps/s", side_cx=sideLength_cx)
+        finally:
+            world.store.close()
+            shutil.rmtree(directory, ignore_errors=True)
+
+@benchmark("minimap")
+def bench_minimap(args):
+    # a whole layer at one pixel per cell, chunks are generated beforehand so only the overview itself is timed
+    _headless_display()
+    tiles = tileset.load_tileset(FC.PLAY_TILES_FILENAME,FC.PLAY_TILES_DIMENSIONS)
+    for sideLength_cx in args.sizes:
+        world = World(sideLength_cx, sideLength_cx, sideLength_cx, seed=0)
+        world.chunks.budget_chunks = sideLength_cx**2
+        for cy in range(sideLength_cx):
+            for cx in range(sideLength_cx):
+                world.getChunkFromCX((cx, cy, 0))
+        overview = minimap.Minimap(world, tiles, span_cx=sideLength_cx)
+        center_ux = (world.dimensions_ux[0] // 2, world.dimensions_ux[1] // 2, 0)
+        startTime = time.perf_counter()
+        overview.surface(center_ux, load=True)
+        cold_s = time.perf_counter() - startTime
+        startTime = time.perf_counter()
+        overview.surface(center_ux, load=True)
+        warm_s = time.perf_counter() - startTime
+        rng = random.Random(0)
+        for _ in range(args.minimap_changes):
+            world.getCell((rng.randrange(world.dimensions_ux[0]), rng.randrange(world.dimensions_ux[1]), 0)).terrainID = rng.randrange(1, 3) # terrain edits as the game makes them
+        startTime = time.perf_counter()
+        overview.surface(center_ux, load=True)
+        incremental_s = time.perf_counter() - startTime
+        print(f"{sideLength_cx}x{sideLength_cx} layer: cold {cold_s*1000:8.2f} ms, warm {warm_s*1000:8.2f} ms, after {args.minimap_changes} changed cells {incremental_s*1000:8.2f} ms")
+        record("minimap", "cold_ms", cold_s*1000, "ms", side_cx=sideLength_cx)
+        record("minimap", "warm_ms", warm_s*1000, "ms", side_cx=sideLength_cx)
+        record("minimap", "incremental_ms", incremental_s*1000, "ms", side_cx=sideLength_cx, changes=args.minimap_changes)
+
+@benchmark("replay")
+def bench_replay(args):
+    # a session recorded with F6 fed back through InputHandler, chunks load synchronously so every run does the same work
+    if args.recording is None:
+        print("no --recording given, nothing to replay")
+        return
+    with open(args.recording) as f:
+        recording = json.load(f)
+    worldDir = recording.get("world_dir")
+    directory = None
+    if worldDir is None:
+        # recordings made before world copies, or of a world never saved, saved edits and legacy worlds' terrain differ from the seed
+        print("warning: the recording holds no world copy, chunks are generated from the seed and may not match the recorded session")
+        world = World(*recording["dimensions_chunks"], recording["chunk_size_ux"], seed=recording["seed"])
+    elif not os.path.isdir(worldDir):
+        print(f"{worldDir} recorded with this session is missing, not replaying against a different world")
+        return
+    else:
+        # replayed from a scratch copy, evictions and saves during the replay must not change the recorded one
+        directory = tempfile.mkdtemp(prefix="doodoo-bench-")
+        world = World.load(shutil.copytree(worldDir, os.path.join(directory, FC.WORLD_DIRNAME)))
+        if world is None or list(world.dimensions_chunks) != list(recording["dimensions_chunks"]) or world.seed != recording["seed"]:
+            print(f"{worldDir} does not hold the recorded world, not replaying")
+            shutil.rmtree(directory, ignore_errors=True)
+            return
+    try:
+        rRenderer = _headless_renderer(world)
+        rRenderer.zoom = recording["zoom"]
+        if recording["debug_mode"]:
+            rRenderer.toggleDebugMode()
+        rRenderer.fov = fov.FieldOfView(world, FC.FOV_RADIUS_ux)
+        rRenderer.fov_enabled = recording["fov_enabled"]
+        rRenderer.minimap = minimap.Minimap(world, rRenderer.tileset, FC.MINIMAP_CELL_px, FC.MINIMAP_SPAN_cx)
+        rRenderer.minimap_enabled = recording.get("minimap_enabled", True) # not in recordings made before the minimap
+        display = pygame.display.get_surface()
+        player = world.entity_index.get(FC.PLAYER_ENTITY_NAME)
+        if player is None:
+            player = Entity(world, FC.PLAYER_ENTITY_NAME, 3, tuple(recording["player_ux"]))
+        handler = input.InputHandler(player, world, rRenderer)
+        playRect = rRenderer.bounds
+        INSTRUMENTS.reset()
+        steps = [] # Format: [(key, recorded_s, elapsed_s)]
+        startTime = time.perf_counter()
+        for recorded_s, key in recording["keys"]:
+            if args.paced:
+                time.sleep(max(0.0, startTime + recorded_s - time.perf_counter()))
+            INSTRUMENTS.enabled = True # an F3 in the recording would switch the statistics off
+            stepStart = time.perf_counter()
+            if handler.handleKeydown(key):
+                world.pinAround(player.coordinates_ux, FC.WORLD_PINNED_RADIUS_cx)
+                display.fill((0,0,0),playRect)
+                rRenderer.render(player.coordinates_ux, player.last_move_ux, display)
+                pygame.display.flip()
+            steps.append((key, recorded_s, time.perf_counter() - stepStart))
+    finally:
+        if directory is not None:
+            world.store.close()
+            shutil.rmtree(directory, ignore_errors=True)
+    elapsed_s = time.perf_counter() - startTime
+    if not steps:
+        print("the recording holds no keys")
+        return
+
+    steps_s = [step_s for _, _, step_s in steps]
+    print(f"{len(steps)} keys {elapsed_s:7.3f} s, mean {sum(steps_s)/len(steps)*1000:7.2f} ms, p95 {_percentile(steps_s, 0.95)*1000:7.2f} ms, max {max(steps_s)*1000:7.2f} ms")
+    for index in sorted(range(len(steps)), key=lambda index: steps[index][2], reverse=True)[:5]:
+        key, recorded_s, step_s = steps[index]
+        print(f"  key {index:>5} {pygame.key.name(key):<8} at {recorded_s:8.3f} s {step_s*1000:9.2f} ms")
+    print(f"{rRenderer.surface_cache}, {rRenderer.recolor}, {world.chunks.evictions} chunk evictions")
+    params = {"recording": os.path.basename(args.recording), "paced": args.paced}
+    record("replay", "mean_step_ms", sum(steps_s)/len(steps)*1000, "ms", **params)
+    record("replay", "p95_step_ms", _percentile(steps_s, 0.95)*1000, "ms", **params)
+    record("replay", "max_step_ms", max(steps_s)*1000, "ms", **params)
+    record("replay", "cache_hits", rRenderer.surface_cache.hits, "surfaces", **params)
+    record("replay", "cache_misses", rRenderer.surface_cache.misses, "surfaces", **params)
+    record("replay", "cache_evictions", rRenderer.surface_cache.evictions, "surfaces", **params)
+    record("replay", "blocking_loads", INSTRUMENTS.counters.get("world.blocking_loads", 0), "chunks", **params)
+    if args.replay_steps:
+        with open(args.replay_steps, "w") as f:
+            json.dump({
+                "steps": [{"key": pygame.key.name(key), "recorded_s": recorded_s, "ms": step_s*1000} for key, recorded_s, step_s in steps],
+                "instruments": INSTRUMENTS.summary(),
+            }, f)
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _run_isolated(names: list[str]):
+    # one process per benchmark so peak RSS and caches are not inherited from the ones before it
+    options, skip = [], False
+    for argument in sys.argv[1:]:
+        if skip:
+            skip = False
+        elif argument in ("--json", "--compare"):
+            skip = True
+        elif argument not in BENCHMARKS and not argument.startswith(("--json=", "--compare=")):
+            options.append(argument)
+    for name in names:
+        with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as f:
+            childPath = f.name
+        try:
+            subprocess.run([sys.executable, os.path.abspath(__file__), name, *options, "--child-results", childPath], check=True)
+            with open(childPath) as f:
+                RESULTS.extend(json.load(f))
+        finally:
+            os.remove(childPath)
+
+def _compare(previousPath: str):
+    # percentage change against a previous --json run, matched on benchmark, metric and params
+    with open(previousPath) as f:
+        previous = {(r["benchmark"], r["metric"], json.dumps(r["params"], sort_keys=True)): r["value"] for r in json.load(f)["results"]}
+    for result in RESULTS:
+        old = previous.get((result["benchmark"], result["metric"], json.dumps(result["params"], sort_keys=True)))
+        if old:
+            params = " ".join(f"{key}={value}" for key, value in result["params"].items())
+            print(f"{result['benchmark']:>8} {result['metric']:<22} {params:<24} {old:12.3f} -> {result['value']:12.3f} {result['unit']:<9} {(result['value']/old - 1)*100:+7.1f}%")
+
+def main():
+    parser = argparse.ArgumentParser(description="doodoo benchmarks")
+    parser.add_argument("names", nargs="*", metavar="name", help=f"any of {', '.join(sorted(BENCHMARKS))}, all when omitted")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[8, 32], help="world side lengths in chunks")
+    parser.add_argument("--legacy-sample", type=int, default=64, help="max legacy chunks actually built")
+    parser.add_argument("--array-sample", type=int, default=4096, help="max array chunks actually built")
+    parser.add_argument("--raster-chunks", type=int, default=256, help="chunks rasterized per zoom level")
+    parser.add_argument("--entities", type=int, nargs="+", default=[1000, 10000, 100000], help="entity counts for the tick benchmark")
+    parser.add_argument("--render-frames", type=int, default=5, help="repeats per zoom level, the fastest is kept")
+    parser.add_argument("--path-queries", type=int, default=200, help="start and goal pairs per world size for the path benchmark")
+    parser.add_argument("--walk-steps", type=int, default=48, help="keydowns per leg of the scripted walk")
+    parser.add_argument("--minimap-changes", type=int, default=64, help="cells marked modified before the incremental minimap redraw")
+    parser.add_argument("--recording", metavar="PATH", help=f"keys recorded with F6 ({FC.RECORDING_FILENAME}) for the replay benchmark")
+    parser.add_argument("--paced", action="store_true", help="replay at the recorded pace instead of as fast as possible")
+    parser.add_argument("--replay-steps", metavar="PATH", help="write every replayed key's time and the full instrument summary here")
+    parser.add_argument("--json", metavar="PATH", help="write the results here, e.g. bench-$(git rev-parse --short HEAD).json")
+    parser.add_argument("--compare", metavar="PATH", help="print the change from a previous --json file")
+    parser.add_argument("--child-results", help=argparse.SUPPRESS) # set by _run_isolated
+    args = parser.parse_args()
+    unknown = [name for name in args.names if name not in BENCHMARKS]
+    if unknown:
+        parser.error(f"unknown benchmark {', '.join(unknown)}")
+    args.json, args.compare, args.recording, args.replay_steps = (path and os.path.abspath(path) for path in (args.json, args.compare, args.recording, args.replay_steps)) # renderer benchmarks chdir into src
+    names = args.names or sorted(BENCHMARKS)
+    if len(names) == 1:
+        print(f"--- {names[0]}")
+        BENCHMARKS[names[0]](args)
+        record(names[0], "peak_rss_MiB", peak_rss_b()/2**20, "MiB")
+        print(f"peak RSS {peak_rss_b()/2**20:.1f} MiB")
+    else:
+        _run_isolated(names)
+    if args.child_results:
+        with open(args.child_results, "w") as f:
+            json.dump(RESULTS, f)
+    if args.json:
+        report = {
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "argv": sys.argv[1:],
+            "results": RESULTS,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=1)
+    if args.compare:
+        _compare(args.compare)
+
+if __name__ == "__main__":
+    main()
@@ -1,17 +1,152 @@
 import pygame
+import numpy
 import random
+from collections import OrderedDict
+
+KEY_COLOR = (255, 255, 255) # the colour a plain tint replaces, tiles are drawn white where they take their colour
+
+def _palette(color) -> tuple:
+    # a single (r, g, b) tints KEY_COLOR, otherwise a tuple of (old, new) pairs for a full palette swap
+    if len(color) == 3 and all(isinstance(channel, int) for channel in color):
+        return ((KEY_COLOR, tuple(color)),)
+    return tuple((tuple(old), tuple(new)) for old, new in color)
+
+def _swap_pixels(rgb: numpy.ndarray, palette: tuple) -> numpy.ndarray:
+    # masks come from the untouched pixels, so swapping a to b and b to a in one palette works
+    swapped = rgb.copy()
+    for old, new in palette:
+        swapped[(rgb == old).all(axis=2)] = new
+    return swapped
+
+def palette_swap(surface: pygame.Surface, palette) -> pygame.Surface:
+    recolored = surface.copy()
+    pixels = pygame.surfarray.pixels3d(recolored)
+    pixels[...] = _swap_pixels(pixels, _palette(palette))
+    del pixels # unlocks the surface
+    return recolored
 
 def recolor_surface(surface, old_color, new_color):
     """Replace all pixels of old_color with new_color"""
-    pxarray = pygame.PixelArray(surface.copy())  # Create editable copy
-    pxarray.replace(old_color, new_color, distance=0.0)  # Exact color match
-    return pxarray.surface  # Return new surface
+    return palette_swap(surface, ((old_color, new_color),))
+
+class _AtlasPage:
+    # one packed surface of same sized slots, reused least recently used first
+    def __init__(self, tileSize_px: tuple[int, int], capacity: int):
+        self.tile_size = tileSize_px
+        self.columns = max(1, int(capacity ** 0.5))
+        rows = -(-capacity // self.columns)
+        self.surface = pygame.Surface((self.columns*tileSize_px[0], rows*tileSize_px[1]), pygame.SRCALPHA)
+        self.slots = [
+            self.surface.subsurface(pygame.Rect(self._slot_topleft(slot), tileSize_px))
+            for slot in range(capacity)
+        ]
+        self.entries = OrderedDict() # Format: {(tileID, color): slot}
+        self.free = list(range(capacity - 1, -1, -1))
+
+    def _slot_topleft(self, slot: int) -> tuple[int, int]:
+        return ((slot % self.columns)*self.tile_size[0], (slot // self.columns)*self.tile_size[1])
+
+    def claim(self, key) -> tuple[int, bool]:
+        # returns (slot, evicted)
+        if self.free:
+            slot, evicted = self.free.pop(), False
+        else:
+            slot, evicted = self.entries.popitem(last=False)[1], True
+        self.entries[key] = slot
+        return slot, evicted
+
+class RecolorAtlas:
+    # (tileID, colour, zoom) variants of a tileset, recoloured with numpy and packed into one surface per zoom
+    # returned surfaces are slots of that page, valid until `capacity` newer variants of the same zoom push them out
+    def __init__(self, tileset: list[pygame.Surface], capacity=1024):
+        self.tileset = tileset
+        self.capacity = capacity
+        self.pages = {} # Format: {zoom: _AtlasPage}
+        self.bases = {} # Format: {(tileID, zoom): (rgb array, alpha array)} scaled source pixels
+        self.masks = {} # Format: {(tileID, zoom, old colour): bool array} where a palette entry applies
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _page(self, zoom: int) -> _AtlasPage:
+        page = self.pages.get(zoom)
+        if page is None:
+            tileWidth_px, tileHeight_px = self.tileset[0].get_size()
+            page = self.pages[zoom] = _AtlasPage((tileWidth_px*zoom, tileHeight_px*zoom), self.capacity)
+        return page
+
+    def _base(self, tileID: int, zoom: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        base = self.bases.get((tileID, zoom))
+        if base is None:
+            tile = self.tileset[tileID] if zoom == 1 else pygame.transform.scale_by(self.tileset[tileID], zoom)
+            base = self.bases[(tileID, zoom)] = (pygame.surfarray.array3d(tile), pygame.surfarray.array_alpha(tile))
+        return base
+
+    def _recolor(self, tileID: int, color, zoom: int) -> tuple[numpy.ndarray, numpy.ndarray]:
+        # masks come from the untouched pixels and are kept, so a tile's hundredth tint costs one copy and assignment
+        rgb, alpha = self._base(tileID, zoom)
+        swapped = rgb.copy()
+        for old, new in _palette(color):
+            mask = self.masks.get((tileID, zoom, old))
+            if mask is None:
+                mask = self.masks[(tileID, zoom, old)] = (rgb == old).all(axis=2)
+            swapped[mask] = new
+        return swapped, alpha
+
+    def _store(self, page: _AtlasPage, variants: list) -> list[pygame.Surface]:
+        # variants is [(key, rgb, alpha)], the page is locked once for the whole batch
+        slots = []
+        for key, rgb, alpha in variants:
+            slot, evicted = page.claim(key)
+            self.evictions += evicted
+            slots.append(slot)
+        width_px, height_px = page.tile_size
+        pixels = pygame.surfarray.pixels3d(page.surface)
+        alphas = pygame.surfarray.pixels_alpha(page.surface)
+        for slot, (key, rgb, alpha) in zip(slots, variants):
+            left_px, top_px = page._slot_topleft(slot)
+            pixels[left_px:left_px+width_px, top_px:top_px+height_px] = rgb
+            alphas[left_px:left_px+width_px, top_px:top_px+height_px] = alpha
+        del pixels, alphas # unlocks the page
+        return [page.slots[slot] for slot in slots]
+
+    def get(self, tileID: int, color, zoom=1) -> pygame.Surface:
+        # colours are keyed as given, the palette is only normalised on a miss
+        key = (tileID, color)
+        page = self._page(zoom)
+        slot = page.entries.get(key)
+        if slot is not None:
+            page.entries.move_to_end(key)
+            self.hits += 1
+            return page.slots[slot]
+        self.misses += 1
+        return self._store(page, [(key, *self._recolor(tileID, color, zoom))])[0]
+
+    def warm(self, tileIDs: list[int], colors: list, zoom=1):
+        # bulk palette swap, every missing variant is written into the page under a single lock
+        page = self._page(zoom)
+        variants = [
+            ((tileID, color), *self._recolor(tileID, color, zoom))
+            for tileID in dict.fromkeys(tileIDs) for color in dict.fromkeys(colors)
+            if (tileID, color) not in page.entries
+        ]
+        self.misses += len(variants)
+        self._store(page, variants[-self.capacity:])
+
+    def __len__(self) -> int:
+        return sum(len(page.entries) for page in self.pages.values())
+
+    def __str__(self):
+        return f"recolor atlas: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, {len(self)} variants"
 
 def random_tile_fill(surface,bounds_rect,tiles_array,zoom,tile_height,tile_width): # practice for renderer (bad btw)
     rSurface = pygame.Surface((bounds_rect.w, bounds_rect.h)) #create a surface the size of bounds rectangle
     scaled_tile_height, scaled_tile_width = tile_height * zoom, tile_width * zoom #actual dimensions
+    atlas = RecolorAtlas(tiles_array, capacity=max(1, (bounds_rect.w // scaled_tile_width) * (bounds_rect.h // scaled_tile_height)))
+    tileBlits = []
     for y in range(0, bounds_rect.h-(scaled_tile_height) +1, scaled_tile_height):
             for x in range(0, bounds_rect.w -(scaled_tile_width)+1, scaled_tile_width):
                 random_color = (random.randint(0,255),random.randint(0,255),random.randint(0,255)) #generate a random color
-                rSurface.blit(recolor_surface(pygame.transform.scale_by(tiles_array[random.randint(0,len(tiles_array)-1)], zoom),(255,255,255),random_color), (x, y))#paste one tile
-    surface.blit(rSurface,(bounds_rect.topleft)) #paste the now filled surface onto initial surface   
\ No newline at end of file
+                tileBlits.append((atlas.get(random.randint(0,len(tiles_array)-1), random_color, zoom), (x, y)))
+    rSurface.blits(tileBlits, doreturn=False) #paste every tile at once, the atlas holds one slot per tile
+    surface.blit(rSurface,(bounds_rect.topleft)) #paste the now filled surface onto initial surface
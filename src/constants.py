@@ -4,6 +4,7 @@ from dataclasses import dataclass
 class FrozenConstants:
     # Display
     DISPLAY_DIMENSIONS: tuple[int,int] = (800,600)
+    MAX_FPS: int = 60 # renders are capped at this rate, the loop sleeps in between
 
     # Input
     KEY_REPEAT_DELAY: int = 500 # in milliseconds
@@ -21,12 +22,31 @@ class FrozenConstants:
     # Zoom
     ZOOM_SCALES = [1,2,3,4,5,6,7,8] #zoom ordered list
 
+    # Render
+    RENDER_CACHE_BUDGET_MB: int = 192 # chunk surfaces, one zoom 8 chunk is 16 MiB
+    FOV_RADIUS_ux: int = 16 # how far the player sees, V toggles the fog
+    MINIMAP_CELL_px: int = 1 # minimap pixels per cell side, M toggles the panel
+    MINIMAP_SPAN_cx: int = 8 # chunks along each side of the minimap, the whole layer of the default world
+
+    # Instrumentation
+    OVERLAY_FONT_FILENAME: str = "8x8_ascii.png" # F3 overlay text
+    OVERLAY_FONT_DIMENSIONS: tuple[int,int] = (8,8) # in px
+    TRACE_FILENAME: str = "trace.json" # written by F4, opens in chrome://tracing or Perfetto
+    TRACE_EVENTS: int = 65536 # most recent trace events kept in memory
+    RECORDING_FILENAME: str = "recording.json" # F6 starts and stops recording keys, replay with bench.py replay --recording
+    RECORDING_WORLD_DIRNAME: str = "recording_world" # copy of the world as it was when recording started, replays start from it
+
     # World
-    WORLD_FILENAME: str = "world.dat"
+    WORLD_DIRNAME: str = "world" # level.dat + region files
+    WORLD_FILENAME: str = "world.dat" # pre-region whole world pickle, imported once if found
     WORLD_WIDTH_cx: int = 8
     WORLD_HEIGHT_cx: int = 8 
     WORLD_DEPTH_ux: int = 8
     CHUNKS_SIDE_LEN_ux: int = 16
+    WORLD_RESIDENT_CHUNKS: int = 128 # chunks kept in memory before least recently used ones are evicted
+    WORLD_PINNED_RADIUS_cx: int = 1 # chunks around the player that are never evicted
+    CHUNK_LOADER_WORKERS: int = 2 # threads generating and decoding chunks in the background
+    LOADER_POLL_MS: int = 16 # how often an idle main loop wakes to install chunks that are still loading
 
     # Player
     PLAYER_ENTITY_NAME: str = "Player Entity"
@@ -38,4 +58,6 @@ class FrozenConstants:
 
 @dataclass
 class RuntimeConfig:
-    PLAYER_ENTITY_TILE_ID: int  = 3
\ No newline at end of file
+    PLAYER_ENTITY_TILE_ID: int  = 3
+    WORLD_SEED: int = None # None picks a random seed for new worlds
+    LOG_LEVEL: int = 20 # 10 debug (every move), 20 info, 30 warnings only
\ No newline at end of file
@@ -0,0 +1,149 @@
+import numpy
+from game import World
+
+# recursive shadowcasting over one z layer, impassable cells block sight
+# octant transforms as (xx, xy, yx, yy), see http://www.roguebasin.com/index.php/FOV_using_recursive_shadowcasting
+OCTANTS = [
+    (1, 0, 0, 1), (0, 1, 1, 0), (0, -1, 1, 0), (-1, 0, 0, 1),
+    (-1, 0, 0, -1), (0, -1, -1, 0), (0, 1, -1, 0), (1, 0, 0, -1),
+]
+
+class FieldOfView:
+    # what the viewer can see within radius_ux, recomputed only when it moves or a chunk in range changes passability
+    def __init__(self, world: World, radius_ux=16):
+        self.world = world
+        self.radius_ux = radius_ux
+        self.opacity = {} # Format: {(cx, cy, uz): (Chunk, passable_revision, numpy bool [y, x])} True blocks sight
+        self.origin_ux = None
+        self.window_revisions = {} # Format: {(cx, cy, uz): revision} of the chunks the current mask was cast over
+        self.visible = numpy.zeros((2*radius_ux + 1, 2*radius_ux + 1), dtype=numpy.bool_) # [y, x] centred on origin_ux
+        self.version = 0 # bumped on every recompute, lets the renderer cache what it derives from the mask
+        self.recomputes = 0
+
+    def _window_chunks(self, origin_ux: tuple[int, int, int]) -> list[tuple[int, int, int]]:
+        chunkSize_ux = self.world.chunk_size_ux
+        x, y, z = origin_ux
+        return [
+            (cx, cy, z)
+            for cy in range((y - self.radius_ux)//chunkSize_ux, (y + self.radius_ux)//chunkSize_ux + 1)
+            for cx in range((x - self.radius_ux)//chunkSize_ux, (x + self.radius_ux)//chunkSize_ux + 1)
+        ]
+
+    def _chunk_opacity(self, key: tuple[int, int, int]) -> numpy.ndarray:
+        # None for chunks outside the world or still loading, which are opaque
+        cx, cy, uz = key
+        chunk = self.world.chunks.get((cx, cy, uz // self.world.chunk_size_ux))
+        if chunk is None:
+            return None
+        cached = self.opacity.get(key)
+        if cached is not None and cached[0] is chunk and cached[1] == chunk.passable_revision:
+            return cached[2]
+        opaque = ~chunk.passable[uz % self.world.chunk_size_ux]
+        self.opacity[key] = (chunk, chunk.passable_revision, opaque)
+        return opaque
+
+    def _revisions(self, keys: list[tuple[int, int, int]]) -> dict:
+        # missing chunks are requested rather than loaded here, their "loading" token changes once ChunkLoader.poll installs them
+        revisions = {}
+        for key in keys:
+            coords_cx = (key[0], key[1], key[2] // self.world.chunk_size_ux)
+            chunk = self.world.requestChunk(coords_cx)
+            if chunk is not None:
+                revisions[key] = (id(chunk), chunk.passable_revision)
+            else:
+                revisions[key] = "loading" if self.world.inBounds(coords_cx) else None
+        return revisions
+
+    def update(self, origin_ux: tuple[int, int, int]) -> bool:
+        # returns whether the mask changed
+        origin_ux = tuple(origin_ux)
+        keys = self._window_chunks(origin_ux)
+        revisions = self._revisions(keys)
+        if origin_ux == self.origin_ux and revisions == self.window_revisions:
+            return False
+        for key in [key for key in self.opacity if key not in revisions]: # keeps evicted chunks from being held on to
+            del self.opacity[key]
+
+        chunkSize_ux = self.world.chunk_size_ux
+        side = 2*self.radius_ux + 1
+        left_ux, top_ux = origin_ux[0] - self.radius_ux, origin_ux[1] - self.radius_ux
+        opaque = numpy.ones((side, side), dtype=numpy.bool_)
+        for key in keys:
+            chunkOpacity = self._chunk_opacity(key)
+            if chunkOpacity is None:
+                continue
+            chunkLeft_ux, chunkTop_ux = key[0]*chunkSize_ux, key[1]*chunkSize_ux
+            x0, y0 = max(left_ux, chunkLeft_ux), max(top_ux, chunkTop_ux)
+            x1, y1 = min(left_ux + side, chunkLeft_ux + chunkSize_ux), min(top_ux + side, chunkTop_ux + chunkSize_ux)
+            opaque[y0-top_ux:y1-top_ux, x0-left_ux:x1-left_ux] = chunkOpacity[y0-chunkTop_ux:y1-chunkTop_ux, x0-chunkLeft_ux:x1-chunkLeft_ux]
+
+        opaqueRows = opaque.tolist() # plain lists index much faster than numpy one cell at a time
+        visibleRows = [[False]*side for _ in range(side)]
+        visibleRows[self.radius_ux][self.radius_ux] = True
+        for xx, xy, yx, yy in OCTANTS:
+            self._cast(opaqueRows, visibleRows, 1, 1.0, 0.0, xx, xy, yx, yy)
+
+        self.visible = numpy.array(visibleRows, dtype=numpy.bool_)
+        self.origin_ux = origin_ux
+        self.window_revisions = revisions
+        self.version += 1
+        self.recomputes += 1
+        return True
+
+    def _cast(self, opaque: list, visible: list, row: int, start: float, end: float, xx: int, xy: int, yx: int, yy: int):
+        # light the slopes between start and end of one octant row by row, recursing around every blocker
+        if start < end:
+            return
+        radius = self.radius_ux
+        radius2 = radius*radius
+        newStart = start
+        for distance in range(row, radius + 1):
+            dx, dy = -distance - 1, -distance
+            blocked = False
+            while dx <= 0:
+                dx += 1
+                leftSlope, rightSlope = (dx - 0.5)/(dy + 0.5), (dx + 0.5)/(dy - 0.5)
+                if start < rightSlope:
+                    continue
+                if end > leftSlope:
+                    break
+                x, y = radius + dx*xx + dy*xy, radius + dx*yx + dy*yy
+                if dx*dx + dy*dy <= radius2:
+                    visible[y][x] = True
+                if blocked:
+                    if opaque[y][x]:
+                        newStart = rightSlope
+                        continue
+                    blocked = False
+                    start = newStart
+                elif opaque[y][x] and distance < radius:
+                    blocked = True
+                    self._cast(opaque, visible, distance + 1, start, leftSlope, xx, xy, yx, yy)
+                    newStart = rightSlope
+            if blocked:
+                break
+
+    def isVisible(self, coords_ux: tuple[int, int, int]) -> bool:
+        if self.origin_ux is None or coords_ux[2] != self.origin_ux[2]:
+            return False
+        x = coords_ux[0] - self.origin_ux[0] + self.radius_ux
+        y = coords_ux[1] - self.origin_ux[1] + self.radius_ux
+        return 0 <= x < self.visible.shape[1] and 0 <= y < self.visible.shape[0] and bool(self.visible[y, x])
+
+    def region(self, left_ux: int, top_ux: int, width_ux: int, height_ux: int, z_ux: int) -> numpy.ndarray:
+        # visibility of any rectangle of the layer as [y, x], False outside the radius
+        mask = numpy.zeros((height_ux, width_ux), dtype=numpy.bool_)
+        if self.origin_ux is None or z_ux != self.origin_ux[2]:
+            return mask
+        side = self.visible.shape[0]
+        windowLeft_ux, windowTop_ux = self.origin_ux[0] - self.radius_ux, self.origin_ux[1] - self.radius_ux
+        x0, y0 = max(left_ux, windowLeft_ux), max(top_ux, windowTop_ux)
+        x1, y1 = min(left_ux + width_ux, windowLeft_ux + side), min(top_ux + height_ux, windowTop_ux + side)
+        if x0 < x1 and y0 < y1:
+            mask[y0-top_ux:y1-top_ux, x0-left_ux:x1-left_ux] = self.visible[y0-windowTop_ux:y1-windowTop_ux, x0-windowLeft_ux:x1-windowLeft_ux]
+        return mask
+
+    def chunkVisible(self, coords_cx: tuple[int, int, int]) -> bool:
+        # coords_cx as (cx, cy, uz) like the renderer's chunk keys
+        chunkSize_ux = self.world.chunk_size_ux
+        return bool(self.region(coords_cx[0]*chunkSize_ux, coords_cx[1]*chunkSize_ux, chunkSize_ux, chunkSize_ux, coords_cx[2]).any())
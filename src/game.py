@@ -1,140 +1,694 @@
 from __future__ import annotations
 import pygame
+import numpy
 import random
 from typing import Dict
+from collections import OrderedDict
+import os
 import pickle 
 import gzip
+import hashlib
+import shutil
+import struct
+from region import WorldStore
+from instrument import INSTRUMENTS
+import worldgen
     
 class World:
     WIDTH_CHUNKS = 8
     HEIGHT_CHUNKS = 8
     DEPTH_CHUNKS = 8
     CHUNK_SIZE_UX = 16
+    RESIDENT_CHUNKS = 128
 
-    def __init__(self):
-        self.chunks: Dict[tuple, Chunk] = {}
+    def __init__(self, width_chunks=WIDTH_CHUNKS, height_chunks=HEIGHT_CHUNKS, depth_chunks=DEPTH_CHUNKS, chunk_size_ux=CHUNK_SIZE_UX, store: WorldStore = None, resident_chunks=RESIDENT_CHUNKS, seed: int = None):
+        # a dimension of None leaves the world unbounded along that axis
+        self.width_chunks = width_chunks
+        self.height_chunks = height_chunks
+        self.depth_chunks = depth_chunks
+        self.chunk_size_ux = chunk_size_ux
+        self.dimensions_chunks = (width_chunks, height_chunks, depth_chunks)
+        self.dimensions_ux = tuple(None if dim is None else dim*chunk_size_ux for dim in self.dimensions_chunks)
+        self.seed = random.getrandbits(32) if seed is None else seed
         self.entity_index = {}
-        self._init_empty_world()
-        self.modified_chunks = set() # Format: {(cx, cy, uz)} uz and cz are the same because chunk depth is 1
+        self.spatial_index = SpatialIndex(chunk_size_ux)
+        self.store = store # chunks not in self.chunks are paged in from here, or generated if they were never saved
+        self.chunks = ChunkManager(self, resident_chunks) # Format: {(cx, cy, cz): Chunk}
+        self.loader = None # optional loader.ChunkLoader, set by the loader itself
+        self.modified_cells_watchers = [] # dicts filled by markCellModified, see watchModifiedCells
+        self.pending_saves = [] # Format: [(Future, path, chunks written, onComplete)] oldest first, see pollSaves
 
-    @staticmethod
-    def uxToCX(coords_ux: tuple[int, int, int]):
-        coords_cx = (coords_ux[0]//World.CHUNK_SIZE_UX, coords_ux[1]//World.CHUNK_SIZE_UX, coords_ux[2])
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.store = None # legacy world.dat pickles hold every chunk in memory
+        self.seed = random.getrandbits(32)
+        self.chunks = ChunkManager(self, World.RESIDENT_CHUNKS)
+        self.chunks.resident.update(state["chunks"])
+        for coords_cx, chunk in self.chunks.items():
+            chunk.world, chunk.coords_cx = self, coords_cx
+        self.loader = None
+        self.modified_cells_watchers = []
+        self.pending_saves = []
+        self.spatial_index = SpatialIndex(self.chunk_size_ux)
+        for entity in self.entity_index.values():
+            if entity.coordinates_ux is not None:
+                self.spatial_index.add(entity, entity.coordinates_ux)
+
+    def uxToCX(self, coords_ux: tuple[int, int, int]):
+        coords_cx = (coords_ux[0]//self.chunk_size_ux, coords_ux[1]//self.chunk_size_ux, coords_ux[2])
         return coords_cx
 
-    def markParentChunkModified(self, coords_ux: tuple[int, int, int]):
+    def uxToChunkKey(self, coords_ux: tuple[int, int, int]):
+        return (coords_ux[0]//self.chunk_size_ux, coords_ux[1]//self.chunk_size_ux, coords_ux[2]//self.chunk_size_ux)
+
+    def watchModifiedCells(self) -> dict:
+        # every watcher gets its own dict so the renderer and anything else can each drain changes at their own pace
+        watcher = {} # Format: {(cx, cy, uz): {(x, y)}} x and y are local to the chunk
+        self.modified_cells_watchers.append(watcher)
+        return watcher
+
+    def unwatchModifiedCells(self, watcher: dict):
+        # by identity, two watchers holding the same changes compare equal
+        self.modified_cells_watchers = [other for other in self.modified_cells_watchers if other is not watcher]
+
+    def markCellModified(self, coords_ux: tuple[int, int, int]):
         coords_cx = self.uxToCX(coords_ux)
-        self.modified_chunks.add(coords_cx)
+        local_ux = (coords_ux[0] % self.chunk_size_ux, coords_ux[1] % self.chunk_size_ux)
+        for watcher in self.modified_cells_watchers:
+            watcher.setdefault(coords_cx, set()).add(local_ux)
 
-    def markChunkCorrected(self, coords_cx: tuple[int,int,int]):
-        if coords_cx in self.modified_chunks:
-            self.modified_chunks.remove(coords_cx)
+    def markCellsModified(self, coords_ux: numpy.ndarray):
+        # a whole batch of (x, y, z) rows at once, see TickScheduler, cells are grouped by chunk layer in numpy
+        if not self.modified_cells_watchers or len(coords_ux) == 0:
+            return
+        layerKeys = numpy.column_stack((coords_ux[:, 0] // self.chunk_size_ux, coords_ux[:, 1] // self.chunk_size_ux, coords_ux[:, 2]))
+        packedKeys = TickScheduler._row_keys(layerKeys)
+        order = numpy.argsort(packedKeys, kind="stable")
+        starts = numpy.flatnonzero(numpy.diff(packedKeys[order], prepend=-1))
+        bounds = numpy.append(starts, len(order)).tolist()
+        localX, localY = (coords_ux[order, 0] % self.chunk_size_ux).tolist(), (coords_ux[order, 1] % self.chunk_size_ux).tolist()
+        changes = { # Format: {(cx, cy, uz): {(x, y)}}
+            key: set(zip(localX[start:end], localY[start:end]))
+            for key, start, end in zip(map(tuple, layerKeys[order[starts]].tolist()), bounds, bounds[1:])
+        }
+        for watcher in self.modified_cells_watchers:
+            for coords_cx, cells in changes.items():
+                watcher.setdefault(coords_cx, set()).update(cells)
 
-    def _init_empty_world(self) -> None:      
-        for cx in range(World.WIDTH_CHUNKS):
-            for cy in range(World.HEIGHT_CHUNKS):
-                for cz in range(World.DEPTH_CHUNKS):
-                    self.chunks[(cx, cy, cz)] = Chunk(World.CHUNK_SIZE_UX) # fill chunks[] with a chunk
+    def inBounds(self, coords_cx: tuple[int, int, int]) -> bool:
+        return all(limit is None or 0 <= coord < limit for coord, limit in zip(coords_cx, self.dimensions_chunks))
 
-    def save(self, filename="world.dat"):
-        with gzip.open(filename, "wb") as f:
-            pickle.dump(self, f, protocol=pickle.HIGHEST_PROTOCOL)
-        print(f"{filename} saved")
+    def save(self, path="world", background=False, onComplete=None):
+        # the main thread only snapshots dirty chunks and the level, the store's writer thread compresses and writes them
+        # background saves are reported by pollSaves, onComplete(path, error) is called there with error None on success
+        if self.store is None or os.path.abspath(self.store.path) != os.path.abspath(path):
+            if self.store is not None: # chunks that are not resident only exist in the old directory
+                self.store.flush()
+                shutil.copytree(self.store.path, path, dirs_exist_ok=True)
+                self.store.close()
+            self.store = WorldStore(path)
+
+        savedChunks = 0
+        with INSTRUMENTS.timer("world.snapshot"):
+            for coords_cx, chunk in self.chunks.items():
+                if chunk.dirty:
+                    self.store.writeChunk(coords_cx, chunk.toBytes()) # a copy, the chunk can keep changing while it is written
+                    chunk.dirty = False
+                    savedChunks += 1
+            future = self.store.commitAsync(self._level())
+        self.chunks.trim() # chunks that were dirty with nowhere to go can be evicted now
+        INSTRUMENTS.count("io.chunks_written", savedChunks)
+        self.pending_saves.append((future, path, savedChunks, onComplete))
+        if not background:
+            future.result()
+            self.pollSaves()
+
+    def pollSaves(self) -> int:
+        # call on the main thread, reports finished saves in the order they were started
+        finished = 0
+        while self.pending_saves and self.pending_saves[0][0].done():
+            future, path, savedChunks, onComplete = self.pending_saves.pop(0)
+            error = future.exception()
+            if error is None:
+                INSTRUMENTS.info("%s saved (%d chunks written)", path, savedChunks)
+            else:
+                INSTRUMENTS.warning("saving %s failed: %s", path, error)
+            if onComplete is not None:
+                onComplete(path, error)
+            finished += 1
+        return finished
+
+    def _level(self) -> dict:
+        return {
+            "dimensions_chunks": self.dimensions_chunks,
+            "chunk_size_ux": self.chunk_size_ux,
+            "seed": self.seed,
+            "entities": [(entity.name, entity.tileID, entity.coordinates_ux, entity.color) for entity in self.entity_index.values()],
+        }
+
+    @staticmethod
+    def load(path="world", resident_chunks=RESIDENT_CHUNKS):
+        if not os.path.isdir(path):
+            return World._load_legacy(path)
+        store = WorldStore(path)
+        try:
+            level = store.readLevel()
+        except (OSError, EOFError, pickle.UnpicklingError):
+            INSTRUMENTS.warning("unable to open %s", path)
+            return None
+        world = World(*level["dimensions_chunks"], level["chunk_size_ux"], store=store, resident_chunks=resident_chunks, seed=level["seed"])
+        for name, tileID, coords_ux, *color in level["entities"]: # color was added after the first level.dat files
+            entity = Entity(world, name, tileID)
+            entity.color = color[0] if color else None
+            entity.coordinates_ux = coords_ux # placed into its cell when that chunk is paged in
+            world.spatial_index.add(entity, coords_ux)
+        INSTRUMENTS.info("%s loaded", path)
+        return world
 
-    def load(filename="world.dat"):
+    @staticmethod
+    def _load_legacy(filename="world.dat"):
+        # whole world pickles written before the region format, every chunk is dirty until saved as regions
         try:
             with gzip.open(filename, 'rb') as f:
-                print(f"{filename} loaded")
-                return pickle.load(f)
-        except (EOFError, pickle.UnpicklingError):
-            print(f"unable to open {filename}")
+                world = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            INSTRUMENTS.warning("unable to open %s", filename)
             return None
-        
+        for chunk in world.chunks.values():
+            chunk.dirty = True
+        for entity in world.entity_index.values():
+            entity.last_move_ux = (0, 0, 0)
+        INSTRUMENTS.info("%s loaded", filename)
+        return world
+
+    def pinAround(self, coords_ux: tuple[int, int, int], radius_cx=1):
+        # keep the chunks around coords_ux resident and page them in early so moving into them never waits on disk
+        cx, cy, cz = self.uxToChunkKey(coords_ux)
+        self.chunks.pinned = {
+            (cx + dx, cy + dy, cz)
+            for dx in range(-radius_cx, radius_cx + 1)
+            for dy in range(-radius_cx, radius_cx + 1)
+        }
+        for coords_cx in self.chunks.pinned:
+            self.requestChunk(coords_cx)
+
     def getChunkFromCX(self,coords_cx: tuple[int, int, int]):
-        if self.chunks.get(coords_cx):
-            return self.chunks.get(coords_cx)
-        return None
-            
+        chunk = self.chunks.get(coords_cx)
+        if chunk is None and self.inBounds(coords_cx):
+            if self.loader is not None:
+                self.loader.discard(coords_cx) # loaded right here instead, a late worker result would be stale
+            INSTRUMENTS.count("world.blocking_loads")
+            chunk = self._produce_chunk(coords_cx)
+            self._install_chunk(coords_cx, chunk)
+        return chunk
+
+    def requestChunk(self, coords_cx: tuple[int, int, int]):
+        # like getChunkFromCX but never blocks when there is a loader, returns None until the chunk is ready
+        if self.loader is None:
+            return self.getChunkFromCX(coords_cx)
+        chunk = self.chunks.get(coords_cx)
+        if chunk is None:
+            self.loader.request(coords_cx)
+        return chunk
+
+    def prefetch(self, chunksWidthRange_cx: range, chunksHeightRange_cx: range, cz: int, heading=(0, 0, 0)):
+        if self.loader is not None:
+            self.loader.prefetch(chunksWidthRange_cx, chunksHeightRange_cx, cz, heading)
+
+    def _produce_chunk(self, coords_cx: tuple[int, int, int]) -> Chunk:
+        # safe to call from loader threads, it only reads the store and the seed
+        data = None if self.store is None else self.store.readChunk(coords_cx)
+        if data is not None:
+            return Chunk.fromBytes(data)
+        chunk = Chunk(self.chunk_size_ux, *worldgen.generateChunk(self.seed, coords_cx, self.chunk_size_ux, Chunk.TERRAIN_DTYPE))
+        chunk.dirty = False # can be generated again from the seed
+        return chunk
+
+    def _install_chunk(self, coords_cx: tuple[int, int, int], chunk: Chunk):
+        chunk.world, chunk.coords_cx = self, coords_cx
+        self.chunks[coords_cx] = chunk
+        self._attach_entities(coords_cx, chunk)
+
+    def _attach_entities(self, coords_cx: tuple[int, int, int], chunk: Chunk):
+        for entity in self.spatial_index.inChunk(coords_cx):
+            chunk.addEntity(tuple(coord % self.chunk_size_ux for coord in entity.coordinates_ux), entity)
+
     def getChunkFromUX(self,coords_ux: tuple[int, int, int]) -> Chunk:
-        coords_cx = self.uxToCX(coords_ux)
-        return self.getChunkFromCX(coords_cx)
+        return self.getChunkFromCX(self.uxToChunkKey(coords_ux))
 
     def getCell(self,coords_ux: tuple[int, int, int]) -> Cell:
         chunk = self.getChunkFromUX(coords_ux)
         if chunk is None:
             return None
-        elif chunk.getCell(coords_ux):
-            return chunk.getCell(coords_ux)
-        return None
+        return chunk.getCell(coords_ux)
+
+class ChunkManager:
+    # resident chunks from least to most recently used, over budget clean chunks are dropped and dirty ones written back first
+    WRITE_BACK_BATCH = 32 # evicted chunks queued in the store before they are committed together
+    def __init__(self, world: World, budget_chunks: int):
+        self.world = world
+        self.budget_chunks = budget_chunks
+        self.resident: OrderedDict[tuple, Chunk] = OrderedDict()
+        self.pinned = set() # Format: {(cx, cy, cz)} never evicted
+        self.evictions = 0
+        self.write_back = None # Future of the last commit started by an eviction
+
+    def get(self, coords_cx: tuple[int, int, int]) -> Chunk:
+        chunk = self.resident.get(coords_cx)
+        if chunk is not None:
+            self.resident.move_to_end(coords_cx)
+        return chunk
+
+    def __setitem__(self, coords_cx: tuple[int, int, int], chunk: Chunk):
+        self.resident[coords_cx] = chunk
+        self.resident.move_to_end(coords_cx)
+        self.trim()
+
+    def __contains__(self, coords_cx) -> bool:
+        return coords_cx in self.resident
+
+    def __len__(self) -> int:
+        return len(self.resident)
+
+    def items(self):
+        return self.resident.items()
+
+    def values(self):
+        return self.resident.values()
+
+    def trim(self):
+        excess = len(self.resident) - self.budget_chunks
+        if excess <= 0:
+            return
+        store = self.world.store
+        victims = []
+        for coords_cx, chunk in self.resident.items():
+            if len(victims) == excess:
+                break
+            if coords_cx in self.pinned or (chunk.dirty and store is None):
+                continue
+            victims.append(coords_cx)
+        for coords_cx in victims:
+            chunk = self.resident.pop(coords_cx)
+            if chunk.dirty:
+                store.writeChunk(coords_cx, chunk.toBytes())
+                chunk.dirty = False
+            self.evictions += 1
+        if store is not None and len(store.pending) >= ChunkManager.WRITE_BACK_BATCH and (self.write_back is None or self.write_back.done()):
+            self.write_back = store.commitAsync() # queued chunks stay readable from the store, the next save or close writes any remainder
+
+class SpatialIndex:
+    # every placed entity by chunk and by square buckets of one z layer, resident or not,
+    # so queries cost time proportional to the entities found rather than the cells covered
+    def __init__(self, chunk_size_ux: int, bucket_ux=8):
+        self.chunk_size_ux = chunk_size_ux
+        self.bucket_ux = bucket_ux
+        self.positions = {} # Format: {Entity: (x, y, z)}
+        self.chunks: Dict[tuple, set] = {} # Format: {(cx, cy, cz): {Entity}}
+        self.buckets: Dict[tuple, set] = {} # Format: {(bx, by, uz): {Entity}}
+        self.layer_counts: Dict[int, int] = {} # Format: {uz: entities on that layer}
+
+    def _chunkKey(self, coords_ux: tuple[int, int, int]) -> tuple[int, int, int]:
+        return (coords_ux[0]//self.chunk_size_ux, coords_ux[1]//self.chunk_size_ux, coords_ux[2]//self.chunk_size_ux)
+
+    def _bucketKey(self, coords_ux: tuple[int, int, int]) -> tuple[int, int, int]:
+        return (coords_ux[0]//self.bucket_ux, coords_ux[1]//self.bucket_ux, coords_ux[2])
+
+    def add(self, entity: Entity, coords_ux: tuple[int, int, int]):
+        if entity in self.positions:
+            self.remove(entity)
+        coords_ux = tuple(coords_ux)
+        self.positions[entity] = coords_ux
+        self.chunks.setdefault(self._chunkKey(coords_ux), set()).add(entity)
+        self.buckets.setdefault(self._bucketKey(coords_ux), set()).add(entity)
+        self.layer_counts[coords_ux[2]] = self.layer_counts.get(coords_ux[2], 0) + 1
+
+    def move(self, entity: Entity, coords_ux: tuple[int, int, int]):
+        # most moves stay inside the same chunk and bucket, those only update the position
+        oldCoords_ux = self.positions.get(entity)
+        if (oldCoords_ux is None or oldCoords_ux[2] != coords_ux[2]
+                or self._chunkKey(oldCoords_ux) != self._chunkKey(coords_ux)
+                or self._bucketKey(oldCoords_ux) != self._bucketKey(coords_ux)):
+            self.add(entity, coords_ux)
+        else:
+            self.positions[entity] = tuple(coords_ux)
+
+    def remove(self, entity: Entity):
+        coords_ux = self.positions.pop(entity, None)
+        if coords_ux is None:
+            return
+        for table, key in ((self.chunks, self._chunkKey(coords_ux)), (self.buckets, self._bucketKey(coords_ux))):
+            members = table[key]
+            members.discard(entity)
+            if not members:
+                del table[key]
+        self.layer_counts[coords_ux[2]] -= 1
+
+    def inChunk(self, coords_cx: tuple[int, int, int]) -> list[Entity]:
+        return list(self.chunks.get(coords_cx, ()))
+
+    def inRect(self, left_ux: int, top_ux: int, right_ux: int, bottom_ux: int, z_ux: int) -> list[Entity]:
+        # right and bottom are exclusive
+        found = []
+        for by in range(top_ux//self.bucket_ux, (bottom_ux-1)//self.bucket_ux + 1):
+            for bx in range(left_ux//self.bucket_ux, (right_ux-1)//self.bucket_ux + 1):
+                for entity in self.buckets.get((bx, by, z_ux), ()):
+                    x, y, z = self.positions[entity]
+                    if left_ux <= x < right_ux and top_ux <= y < bottom_ux:
+                        found.append(entity)
+        return found
+
+    def inRadius(self, center_ux: tuple[int, int, int], radius_ux: float) -> list[Entity]:
+        cx, cy, cz = center_ux
+        reach = int(radius_ux)
+        return [
+            entity for entity in self.inRect(cx - reach, cy - reach, cx + reach + 1, cy + reach + 1, cz)
+            if (self.positions[entity][0] - cx)**2 + (self.positions[entity][1] - cy)**2 <= radius_ux**2
+        ]
+
+    def nearest(self, center_ux: tuple[int, int, int], maxRadius_ux: float = None, exclude: Entity = None) -> Entity:
+        # searches rings of buckets outwards until no closer entity can exist
+        cx, cy, cz = center_ux
+        candidates = self.layer_counts.get(cz, 0)
+        if exclude in self.positions and self.positions[exclude][2] == cz:
+            candidates -= 1
+        if candidates <= 0:
+            return None
+        centerBX, centerBY = cx//self.bucket_ux, cy//self.bucket_ux
+        best, bestDistance2 = None, float("inf")
+        ring = 0
+        while True:
+            for by in range(centerBY - ring, centerBY + ring + 1):
+                step = 1 if by in (centerBY - ring, centerBY + ring) else 2*ring # only the edge of the ring
+                for bx in range(centerBX - ring, centerBX + ring + 1, step):
+                    for entity in self.buckets.get((bx, by, cz), ()):
+                        if entity is exclude:
+                            continue
+                        x, y, z = self.positions[entity]
+                        distance2 = (x - cx)**2 + (y - cy)**2
+                        if distance2 < bestDistance2:
+                            best, bestDistance2 = entity, distance2
+            searched_ux = ring*self.bucket_ux # everything closer than this has been seen
+            if best is not None and bestDistance2 <= searched_ux**2:
+                break
+            if maxRadius_ux is not None and searched_ux > maxRadius_ux:
+                break
+            ring += 1
+        if maxRadius_ux is not None and bestDistance2 > maxRadius_ux**2:
+            return None
+        return best
 
 class Cell:
-    def __init__(self, terrainID=1,passable=True):
-        self.entities = [] #cell has list of entities
-        self.terrainID  = terrainID
-        self.passable = passable
+    # lightweight view of one cell, the data itself lives in the parent chunk's arrays
+    __slots__ = ("chunk", "local_ux", "_legacy_state")
+
+    def __init__(self, chunk: Chunk, local_ux: tuple[int, int, int]):
+        self.chunk = chunk
+        self.local_ux = local_ux # Format: (x, y, z) inside the chunk
+
+    @property
+    def terrainID(self) -> int:
+        x, y, z = self.local_ux
+        return int(self.chunk.terrain[z, y, x])
+
+    @terrainID.setter
+    def terrainID(self, terrainID: int):
+        x, y, z = self.local_ux
+        self.chunk.terrain[z, y, x] = terrainID
+        self.chunk.terrain_revision += 1
+        self.chunk.dirty = True
+        self.chunk.cellModified(self.local_ux)
+
+    @property
+    def passable(self) -> bool:
+        x, y, z = self.local_ux
+        return bool(self.chunk.passable[z, y, x])
+
+    @passable.setter
+    def passable(self, passable: bool):
+        x, y, z = self.local_ux
+        self.chunk.passable[z, y, x] = passable
+        self.chunk.passable_revision += 1
+        self.chunk.dirty = True
+        self.chunk.cellModified(self.local_ux)
+
+    @property
+    def entities(self) -> list:
+        return list(self.chunk.entities.get(self.local_ux, ()))
+
+    def __setstate__(self, state):
+        self._legacy_state = state # pre-array world.dat pickles stored Cell objects, Chunk.__setstate__ converts them
 
 class Chunk:
-    def __init__(self):
-        self.cells = [[[Cell(random.randint(1, 2), True) for z in range(World.CHUNK_SIZE_UX)]
-                       for y in range(World.CHUNK_SIZE_UX)]
-                       for x in range(World.CHUNK_SIZE_UX)]
+    TERRAIN_DTYPE = numpy.uint8 # 16x16_tiles.png holds 256 tiles
+    RECORD_HEADER = struct.Struct("<BH") # record version, side length
+    RECORD_VERSION = 1
+    passable_revision = 0 # bumped by Cell.passable, lets sight caches skip chunks whose passability is unchanged
+    terrain_revision = 0 # bumped by Cell.terrainID, the same for caches of what the terrain looks like
+    world = None # set when the chunk is installed, cell edits are reported to its modified cells watchers
+    coords_cx = None
+    passable_digest = None # Format: (passable_revision, digest) see passableDigest
+
+    def __init__(self, sideLength_ux=World.CHUNK_SIZE_UX, terrain=None, passable=None):
+        self.sideLength_ux = sideLength_ux
+        shape = (sideLength_ux, sideLength_ux, sideLength_ux) # indexed [z, y, x] so a z layer is one contiguous block
+        if terrain is None:
+            terrain = numpy.ones(shape, dtype=Chunk.TERRAIN_DTYPE)
+        if passable is None:
+            passable = numpy.ones(shape, dtype=numpy.bool_)
+        self.terrain = terrain
+        self.passable = passable
+        self.entities: Dict[tuple, dict] = {} # sparse, Format: {(x, y, z) local: {Entity: None}} dicts keep arrival order, first is drawn
+        self.dirty = True # terrain differs from what is on disk
+
+    def passableDigest(self) -> bytes:
+        # the same for an unchanged chunk paged back in, unlike the chunk object or its revision, so path caches survive eviction
+        if self.passable_digest is None or self.passable_digest[0] != self.passable_revision:
+            self.passable_digest = (self.passable_revision, hashlib.blake2b(self.passable.tobytes(), digest_size=16).digest())
+        return self.passable_digest[1]
+
+    def toBytes(self) -> bytes:
+        # entities are not part of the record, they are saved with the world and reattached on load
+        header = Chunk.RECORD_HEADER.pack(Chunk.RECORD_VERSION, self.sideLength_ux)
+        return header + self.terrain.tobytes() + numpy.packbits(self.passable).tobytes()
+
+    @staticmethod
+    def fromBytes(data: bytes) -> Chunk:
+        version, sideLength_ux = Chunk.RECORD_HEADER.unpack_from(data)
+        if version != Chunk.RECORD_VERSION:
+            raise ValueError(f"unknown chunk record version {version}")
+        shape = (sideLength_ux, sideLength_ux, sideLength_ux)
+        cellCount = sideLength_ux ** 3
+        offset = Chunk.RECORD_HEADER.size
+        terrain = numpy.frombuffer(data, Chunk.TERRAIN_DTYPE, cellCount, offset).reshape(shape).copy()
+        offset += terrain.nbytes
+        passable = numpy.unpackbits(numpy.frombuffer(data, numpy.uint8, offset=offset), count=cellCount).astype(numpy.bool_).reshape(shape)
+        chunk = Chunk(sideLength_ux, terrain, passable)
+        chunk.dirty = False
+        return chunk
 
     def getCell(self,coords_ux: tuple[int, int, int]) -> Cell:
-        x, y, z = (coord % World.CHUNK_SIZE_UX for coord in coords_ux)
-        if self.cells[x][y][z]:
-            return self.cells[x][y][z]
-        return None
-    
+        return Cell(self, tuple(coord % self.sideLength_ux for coord in coords_ux))
+
+    def cellModified(self, local_ux: tuple[int, int, int]):
+        if self.world is not None:
+            self.world.markCellModified(tuple(chunk*self.sideLength_ux + coord for chunk, coord in zip(self.coords_cx, local_ux)))
+
+    def addEntity(self, local_ux: tuple[int, int, int], entity: Entity) -> bool:
+        cellEntities = self.entities.setdefault(local_ux, {})
+        if entity in cellEntities:
+            return False
+        cellEntities[entity] = None
+        return True
+
+    def removeEntity(self, local_ux: tuple[int, int, int], entity: Entity) -> bool:
+        cellEntities = self.entities.get(local_ux)
+        if not cellEntities or entity not in cellEntities:
+            return False
+        del cellEntities[entity]
+        if not cellEntities:
+            del self.entities[local_ux]
+        return True
+
+    def __setstate__(self, state):
+        if "cells" not in state:
+            self.__dict__.update(state)
+            return
+        # convert a pickled 16x16x16 nested list of Cell objects into the array layout
+        cells = state["cells"]
+        self.__init__(state.get("sideLength_ux", len(cells)))
+        for x, plane in enumerate(cells):
+            for y, column in enumerate(plane):
+                for z, cell in enumerate(column):
+                    legacy = cell._legacy_state
+                    self.terrain[z, y, x] = legacy["terrainID"]
+                    self.passable[z, y, x] = legacy["passable"]
+                    for entity in legacy["entities"]:
+                        self.addEntity((x, y, z), entity)
+
     def __repr__(self):
-        return f"{World.CHUNK_SIZE_UX}^3 volume chunk at --,--,--"
+        return f"{self.sideLength_ux}^3 volume chunk at --,--,--"
     
 class Entity:
+    color = None # render tint, see change_surface.RecolorAtlas, None draws the tile as it is in the tileset
+
     def __init__(self,world: World, name = "Unnamed Entity",tileID = 3,coords_ux = None):
         self.coordinates_ux = None
         self.world = world
         self.tileID = tileID
         self.name = name
+        self.last_move_ux = (0, 0, 0) # direction of the latest move, used to prefetch chunks ahead
         self.world.entity_index[self.name] = self
-        self.setPosition(coords_ux)
+        if coords_ux is not None:
+            self.setPosition(coords_ux)
 
     def setPosition(self,newCoords_ux: tuple[int, int, int]) -> int:
         newCell = self.world.getCell(newCoords_ux)
         if(newCell is None):
-            print(f"{self.name} tried to move out of bounds             ( {self.coordinates_ux} -/> {newCoords_ux} )")
+            INSTRUMENTS.count("move.out_of_bounds")
+            INSTRUMENTS.debug("%s tried to move out of bounds             ( %s -/> %s )", self.name, self.coordinates_ux, newCoords_ux)
         elif(newCell.passable == False):
-            print(f"{self.name} tried to move into an impassable cell   ( {self.coordinates_ux} -/> {newCoords_ux} )")
+            INSTRUMENTS.count("move.blocked")
+            INSTRUMENTS.debug("%s tried to move into an impassable cell   ( %s -/> %s )", self.name, self.coordinates_ux, newCoords_ux)
         elif(self.coordinates_ux == newCoords_ux):
-            print(f"{self.name} stayed still                            ( {self.coordinates_ux}  =  {newCoords_ux} )")
+            INSTRUMENTS.debug("%s stayed still                            ( %s  =  %s )", self.name, self.coordinates_ux, newCoords_ux)
         elif(self.coordinates_ux is None):
             self._add_to_cell(newCoords_ux)
-            print(f"{self.name} spawned                                 ( {self.coordinates_ux} )")
+            INSTRUMENTS.count("move.spawned")
+            INSTRUMENTS.debug("%s spawned                                 ( %s )", self.name, self.coordinates_ux)
         else:
             oldCoords_ux = self.coordinates_ux
             self._remove_from_cell(oldCoords_ux)
             self._add_to_cell(newCoords_ux)
-            print(f"{self.name} moved                                   ( {oldCoords_ux} --> {self.coordinates_ux} )")
+            INSTRUMENTS.count("move.moved")
+            INSTRUMENTS.debug("%s moved                                   ( %s --> %s )", self.name, oldCoords_ux, self.coordinates_ux)
 
     def _add_to_cell(self,coords_ux):
         cell = self.world.getCell(coords_ux)
-        if self not in cell.entities:
-            cell.entities.append(self)
+        if cell.chunk.addEntity(cell.local_ux, self):
             self.coordinates_ux = coords_ux
-            self.world.markParentChunkModified(coords_ux)
+            self.world.spatial_index.add(self, coords_ux)
+            self.world.markCellModified(coords_ux)
 
     def _remove_from_cell(self,coords_ux):
         cell = self.world.getCell(coords_ux)
-        if self in cell.entities:
-            cell.entities.remove(self)
+        if cell.chunk.removeEntity(cell.local_ux, self):
             self.coordinates_ux = None
-            self.world.markParentChunkModified(coords_ux)
+            self.world.spatial_index.remove(self)
+            self.world.markCellModified(coords_ux)
+
+    def setColor(self, color):
+        # an (r, g, b) tint or a tuple of (old, new) colour pairs, the renderer only repaints this entity's cell
+        self.color = color
+        if self.coordinates_ux is not None:
+            self.world.markCellModified(self.coordinates_ux)
 
     def move(self,magnitudeX_ux,magnitudeY_ux,magnitudeZ_ux):
-        self.setPosition([
+        self.last_move_ux = (magnitudeX_ux, magnitudeY_ux, magnitudeZ_ux)
+        self.setPosition((
             self.coordinates_ux[0] + magnitudeX_ux,
             self.coordinates_ux[1] + magnitudeY_ux,
             self.coordinates_ux[2] + magnitudeZ_ux
-        ])
+        ))
 
     def __repr__(self):
         return f"<{self.name} at {self.coordinates_ux}>"
 
+
+class TickScheduler:
+    # collects the moves of many entities and resolves them together once per turn
+    def __init__(self, world: World):
+        self.world = world
+        self.queued = {} # Format: {Entity: (dx, dy, dz)} in the order moves were first queued
+
+    def queueMove(self, entity: Entity, magnitudeX_ux, magnitudeY_ux, magnitudeZ_ux):
+        # queueing an entity again this turn replaces its earlier move
+        if entity.coordinates_ux is not None:
+            self.queued[entity] = (magnitudeX_ux, magnitudeY_ux, magnitudeZ_ux)
+
+    @staticmethod
+    def _row_keys(rows: numpy.ndarray) -> numpy.ndarray:
+        # packs every (x, y, z) row into one int64 so numpy.unique sorts plain integers instead of rows
+        lows = rows.min(axis=0)
+        spans = (rows.max(axis=0) - lows + 1).tolist()
+        if spans[0] * spans[1] * spans[2] >= 2**62:
+            return numpy.unique(rows, axis=0, return_inverse=True)[1].reshape(-1)
+        shifted = rows - lows
+        return (shifted[:, 2] * spans[1] + shifted[:, 1]) * spans[0] + shifted[:, 0]
+
+    def _passable(self, targets_ux: numpy.ndarray, valid: numpy.ndarray) -> numpy.ndarray:
+        # gather passability with one fancy index per chunk instead of one getCell per entity
+        chunkSize_ux = self.world.chunk_size_ux
+        passable = numpy.zeros(len(targets_ux), dtype=numpy.bool_)
+        candidates = numpy.flatnonzero(valid)
+        if len(candidates) == 0:
+            return passable
+        chunkKeys = targets_ux[candidates] // chunkSize_ux
+        rowKeys = self._row_keys(chunkKeys)
+        order = numpy.argsort(rowKeys, kind="stable")
+        starts = numpy.flatnonzero(numpy.diff(rowKeys[order], prepend=-1))
+        bounds = numpy.append(starts, len(order))
+        for group, key in enumerate(chunkKeys[order[starts]].tolist()):
+            members = candidates[order[bounds[group]:bounds[group + 1]]]
+            chunk = self.world.getChunkFromCX(tuple(key))
+            if chunk is None:
+                continue
+            local = targets_ux[members] % chunkSize_ux
+            passable[members] = chunk.passable[local[:, 2], local[:, 1], local[:, 0]]
+        return passable
+
+    def tick(self) -> int:
+        # returns how many queued moves were applied, the rest were out of bounds, blocked or lost a conflict
+        with INSTRUMENTS.timer("tick"):
+            applied = self._resolve()
+        INSTRUMENTS.count("tick.applied", applied)
+        return applied
+
+    def _resolve(self) -> int:
+        if not self.queued:
+            return 0
+        entities = list(self.queued)
+        moves = list(self.queued.values())
+        deltas_ux = numpy.array(moves, dtype=numpy.int64)
+        self.queued = {}
+        origins_ux = numpy.array([entity.coordinates_ux for entity in entities], dtype=numpy.int64)
+        targets_ux = origins_ux + deltas_ux
+
+        lower_ux = numpy.array([numpy.iinfo(numpy.int64).min if dim is None else 0 for dim in self.world.dimensions_ux])
+        upper_ux = numpy.array([numpy.iinfo(numpy.int64).max if dim is None else dim for dim in self.world.dimensions_ux])
+        valid = (targets_ux >= lower_ux).all(axis=1) & (targets_ux < upper_ux).all(axis=1) & deltas_ux.any(axis=1)
+        valid &= self._passable(targets_ux, valid)
+
+        # when several movers want the same cell the one queued first gets it
+        movers = numpy.flatnonzero(valid)
+        if len(movers) == 0:
+            return 0
+        uniqueTargets, firstIndices = numpy.unique(self._row_keys(targets_ux[movers]), return_index=True)
+        winners = numpy.sort(movers[firstIndices])
+
+        # chunk keys and local coords for the whole batch at once, every chunk is looked up only once
+        chunkSize_ux = self.world.chunk_size_ux
+        spatialIndex = self.world.spatial_index
+        chunks = {} # Format: {(cx, cy, cz): Chunk}
+        def chunkAt(key):
+            chunk = chunks.get(key)
+            if chunk is None:
+                chunk = chunks[key] = self.world.getChunkFromCX(key)
+            return chunk
+        origins, targets = origins_ux[winners], targets_ux[winners]
+        # rows are zipped back together from column lists, tolist on the rows would allocate a list per mover and
+        # every few hundred of those set off a collection that walks all live entities
+        def rows(array):
+            return zip(*array.T.tolist())
+        for index, target, originKey, targetKey, originLocal, targetLocal in zip(
+                winners.tolist(), rows(targets),
+                rows(origins // chunkSize_ux), rows(targets // chunkSize_ux),
+                rows(origins % chunkSize_ux), rows(targets % chunkSize_ux)):
+            entity = entities[index]
+            chunkAt(originKey).removeEntity(originLocal, entity)
+            chunkAt(targetKey).addEntity(targetLocal, entity)
+            entity.coordinates_ux = target
+            entity.last_move_ux = moves[index]
+            spatialIndex.move(entity, target)
+        self.world.markCellsModified(numpy.concatenate((origins, targets)))
+        return len(winners)
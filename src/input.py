@@ -1,7 +1,12 @@
 import pygame
+import json
+import os
+import shutil
+import time
 from game import Entity, World
 from renderer import Renderer
 from constants import FrozenConstants as FC
+from instrument import INSTRUMENTS
 
 
 class InputHandler:
@@ -9,6 +14,8 @@ class InputHandler:
                 self.player = player
                 self.world = world
                 self.renderer = renderer
+                self.recording = None # Format: {"seed", ..., "keys": [[seconds since recording started, key]]} while F6 is recording
+                self.recording_start_s = None
 
                 self.keybinds = {
                         pygame.K_w:     {"func": lambda: self.player.move(0,-1,0), "render": True},
@@ -22,15 +29,65 @@ class InputHandler:
 
                         pygame.K_MINUS:     {"func": lambda: self.renderer.decrementZoom(), "render": True},
                         pygame.K_EQUALS:    {"func": lambda: self.renderer.incrementZoom(), "render": True},
+                        pygame.K_v:         {"func": lambda: self.renderer.toggleFieldOfView(), "render": True},
+                        pygame.K_m:         {"func": lambda: self.renderer.toggleMinimap(), "render": True},
 
-                        pygame.K_F5:     {"func": lambda: self.world.save(FC.WORLD_FILENAME), "render": False},
-                        pygame.K_F9:     {"func": lambda: self.world.load(FC.WORLD_FILENAME), "render": False},
+                        # "record": False keeps keys that touch files out of recordings, a replay must never overwrite the world
+                        pygame.K_F5:     {"func": lambda: self.world.save(FC.WORLD_DIRNAME, background=True), "render": False, "record": False},
 
-                        pygame.K_F3: {"func": lambda: self.renderer.toggleDebugMode(),"render": True}
+                        pygame.K_F3: {"func": lambda: self.toggleOverlay(),"render": True},
+                        pygame.K_F4: {"func": lambda: self.exportTrace(),"render": False, "record": False},
+                        pygame.K_F6: {"func": lambda: self.toggleRecording(),"render": False, "record": False}
                 }
 
+        def toggleOverlay(self):
+                # the grid and the instrumentation overlay come and go together
+                self.renderer.toggleDebugMode()
+                INSTRUMENTS.enabled = self.renderer.debug_mode
+
+        def exportTrace(self):
+                INSTRUMENTS.exportTrace(FC.TRACE_FILENAME)
+                INSTRUMENTS.info("trace written to %s (%d events)", FC.TRACE_FILENAME, len(INSTRUMENTS.trace))
+
+        def startRecording(self):
+                # everything bench.py replay needs to rebuild the session, edited chunks come from a copy of the saved world
+                worldDir = None
+                if self.world.store is not None:
+                        self.world.save(self.world.store.path) # waits, so the copy holds every edit made so far
+                        worldDir = os.path.abspath(FC.RECORDING_WORLD_DIRNAME)
+                        shutil.rmtree(worldDir, ignore_errors=True)
+                        shutil.copytree(self.world.store.path, worldDir)
+                self.recording = {
+                        "seed": self.world.seed,
+                        "world_dir": worldDir, # None for worlds never saved, which replay from the seed alone
+                        "dimensions_chunks": self.world.dimensions_chunks,
+                        "chunk_size_ux": self.world.chunk_size_ux,
+                        "player_ux": self.player.coordinates_ux,
+                        "zoom": self.renderer.zoom,
+                        "debug_mode": self.renderer.debug_mode,
+                        "fov_enabled": self.renderer.fov_enabled,
+                        "minimap_enabled": self.renderer.minimap_enabled,
+                        "keys": [],
+                }
+                self.recording_start_s = time.perf_counter()
+                INSTRUMENTS.info("recording input")
+
+        def stopRecording(self, path=FC.RECORDING_FILENAME):
+                with open(path, "w") as f:
+                        json.dump(self.recording, f)
+                INSTRUMENTS.info("%d keys recorded to %s", len(self.recording["keys"]), path)
+                self.recording = None
+
+        def toggleRecording(self):
+                if self.recording is None:
+                        self.startRecording()
+                else:
+                        self.stopRecording()
+
         def handleKeydown(self, key) -> bool:
                 if key in self.keybinds:
+                        if self.recording is not None and self.keybinds[key].get("record", True):
+                                self.recording["keys"].append([time.perf_counter() - self.recording_start_s, key])
                         self.keybinds[key]["func"]()
                         return self.keybinds[key]["render"]
                 return False
\ No newline at end of file
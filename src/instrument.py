@@ -0,0 +1,146 @@
+import json
+import sys
+import time
+from collections import deque
+from constants import FrozenConstants as FC
+
+# leveled logging plus counters, timers and a frame time histogram
+# everything but log() is a no-op until enabled, hot paths also check INSTRUMENTS.enabled themselves
+# so a disabled build pays one attribute lookup per call site
+
+DEBUG = 10
+INFO = 20
+WARNING = 30
+ERROR = 40
+LEVEL_NAMES = {DEBUG: "debug", INFO: "info", WARNING: "warning", ERROR: "error"}
+
+FRAME_BUCKETS_MS = (2, 4, 8, 16, 33, 66, 133) # upper bounds, the last bucket catches everything slower
+
+class _NullTimer:
+    # handed out while disabled so `with INSTRUMENTS.timer(...)` costs no clock reads
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+_NULL_TIMER = _NullTimer()
+
+class _Timer:
+    __slots__ = ("instruments", "name", "start_s")
+
+    def __init__(self, instruments, name: str):
+        self.instruments = instruments
+        self.name = name
+
+    def __enter__(self):
+        self.start_s = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.instruments.addTime(self.name, self.start_s, time.perf_counter() - self.start_s)
+        return False
+
+class Instruments:
+    def __init__(self, level=INFO, enabled=False, traceEvents=4096, stream=None):
+        self.level = level # messages below this are dropped before they are formatted
+        self.enabled = enabled
+        self.stream = stream # None means whatever sys.stdout is at the time
+        self.counters = {} # Format: {name: count}
+        self.gauges = {} # Format: {name: last value}
+        self.timers = {} # Format: {name: [calls, total_s, max_s]}
+        self.frame_histogram = [0] * (len(FRAME_BUCKETS_MS) + 1)
+        self.frame_times_ms = deque(maxlen=120) # most recent frames, for the overlay average
+        self.trace = deque(maxlen=traceEvents) # Format: [chrome trace event dict], oldest dropped first
+        self.origin_s = time.perf_counter()
+
+    def _timestamp_us(self, at_s: float = None) -> float:
+        return ((time.perf_counter() if at_s is None else at_s) - self.origin_s) * 1e6
+
+    def log(self, level: int, message: str, *args):
+        # message is %-formatted only when it will actually be shown
+        if level < self.level:
+            return
+        text = message % args if args else message
+        print(text, file=self.stream or sys.stdout)
+        if self.enabled:
+            self.trace.append({"name": text, "cat": LEVEL_NAMES.get(level, str(level)), "ph": "i", "s": "g", "ts": self._timestamp_us(), "pid": 0, "tid": 0})
+
+    def debug(self, message: str, *args):
+        if self.level <= DEBUG:
+            self.log(DEBUG, message, *args)
+
+    def info(self, message: str, *args):
+        self.log(INFO, message, *args)
+
+    def warning(self, message: str, *args):
+        self.log(WARNING, message, *args)
+
+    def count(self, name: str, amount=1):
+        if self.enabled:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def gauge(self, name: str, value):
+        if self.enabled:
+            self.gauges[name] = value
+
+    def timer(self, name: str):
+        return _Timer(self, name) if self.enabled else _NULL_TIMER
+
+    def addTime(self, name: str, start_s: float, elapsed_s: float):
+        stats = self.timers.get(name)
+        if stats is None:
+            stats = self.timers[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        stats[1] += elapsed_s
+        stats[2] = max(stats[2], elapsed_s)
+        self.trace.append({"name": name, "ph": "X", "ts": self._timestamp_us(start_s), "dur": elapsed_s * 1e6, "pid": 0, "tid": 0})
+
+    def frame(self, elapsed_s: float):
+        if not self.enabled:
+            return
+        elapsed_ms = elapsed_s * 1000
+        bucket = 0
+        while bucket < len(FRAME_BUCKETS_MS) and elapsed_ms > FRAME_BUCKETS_MS[bucket]:
+            bucket += 1
+        self.frame_histogram[bucket] += 1
+        self.frame_times_ms.append(elapsed_ms)
+        self.trace.append({"name": "frame", "ph": "C", "ts": self._timestamp_us(), "args": {"ms": elapsed_ms}, "pid": 0, "tid": 0})
+
+    def reset(self):
+        self.counters.clear()
+        self.gauges.clear()
+        self.timers.clear()
+        self.frame_histogram = [0] * (len(FRAME_BUCKETS_MS) + 1)
+        self.frame_times_ms.clear()
+        self.trace.clear()
+
+    def summary(self) -> dict:
+        return {
+            "counters": dict(self.counters),
+            "gauges": dict(self.gauges),
+            "timers": {name: {"calls": calls, "total_s": total_s, "max_s": max_s} for name, (calls, total_s, max_s) in self.timers.items()},
+            "frame_histogram_ms": {f"<={bound}": count for bound, count in zip(FRAME_BUCKETS_MS, self.frame_histogram)} | {f">{FRAME_BUCKETS_MS[-1]}": self.frame_histogram[-1]},
+        }
+
+    def overlayLines(self) -> list[str]:
+        lines = []
+        if self.frame_times_ms:
+            average_ms = sum(self.frame_times_ms) / len(self.frame_times_ms)
+            lines.append(f"frame {average_ms:6.2f} ms avg {max(self.frame_times_ms):6.2f} ms max")
+        labels = [f"<={bound}" for bound in FRAME_BUCKETS_MS] + [f">{FRAME_BUCKETS_MS[-1]}"]
+        lines.append(" ".join(f"{label}:{count}" for label, count in zip(labels, self.frame_histogram)))
+        for name, (calls, total_s, max_s) in sorted(self.timers.items()):
+            lines.append(f"{name:<20} {calls:>7} {total_s*1000/calls:8.3f} ms avg {max_s*1000:8.3f} max")
+        for name, count in sorted(self.counters.items()):
+            lines.append(f"{name:<20} {count:>9}")
+        for name, value in sorted(self.gauges.items()):
+            lines.append(f"{name:<20} {value:>9}")
+        return lines
+
+    def exportTrace(self, path: str):
+        # chrome://tracing / Perfetto format, the summary rides along as metadata
+        with open(path, "w") as f:
+            json.dump({"traceEvents": list(self.trace), "displayTimeUnit": "ms", "metadata": self.summary()}, f)
+
+INSTRUMENTS = Instruments(traceEvents=FC.TRACE_EVENTS) # shared by every module, main and bench decide whether it is enabled
@@ -0,0 +1,71 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from game import World
+from instrument import INSTRUMENTS
+
+RETRY_MAX_S = 32 # longest wait before a chunk that failed to load is requested again
+
+class ChunkLoader:
+    # reads or generates chunks on worker threads, finished chunks are only installed into the world by poll() on the main thread
+    def __init__(self, world: World, workers=2):
+        self.world = world
+        self.pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="chunk-loader")
+        self.pending = {} # Format: {(cx, cy, cz): Future}
+        self.failed = {} # Format: {(cx, cy, cz): (attempts, retry at in time.monotonic() seconds)} left as placeholders meanwhile
+        world.loader = self
+
+    def request(self, coords_cx: tuple[int, int, int]):
+        if coords_cx in self.pending or coords_cx in self.world.chunks or not self.world.inBounds(coords_cx):
+            return
+        if coords_cx in self.failed and time.monotonic() < self.failed[coords_cx][1]:
+            return
+        self.pending[coords_cx] = self.pool.submit(self.world._produce_chunk, coords_cx)
+
+    def discard(self, coords_cx: tuple[int, int, int]):
+        future = self.pending.pop(coords_cx, None)
+        if future is not None:
+            future.cancel()
+
+    def poll(self) -> int:
+        finished = [coords_cx for coords_cx, future in self.pending.items() if future.done()]
+        for coords_cx in finished:
+            future = self.pending.pop(coords_cx)
+            try:
+                chunk = future.result()
+            except Exception as error:
+                # never replaced by other terrain, an edit to a stand-in would overwrite the saved record on the next save
+                attempts = self.failed.get(coords_cx, (0, 0))[0] + 1
+                retry_s = min(2 ** attempts, RETRY_MAX_S)
+                self.failed[coords_cx] = (attempts, time.monotonic() + retry_s)
+                INSTRUMENTS.count("loader.failed")
+                INSTRUMENTS.warning("chunk %s could not be loaded (%s), it stays unloaded and is tried again in %d s", coords_cx, error, retry_s)
+                continue
+            self.failed.pop(coords_cx, None)
+            if coords_cx not in self.world.chunks:
+                self.world._install_chunk(coords_cx, chunk)
+                INSTRUMENTS.count("loader.installed")
+        return len(finished)
+
+    def prefetch(
+            self,
+            chunksWidthRange_cx: range,
+            chunksHeightRange_cx: range,
+            cz: int,
+            heading: tuple[int, int, int],
+            ):
+        # request the ring of chunks just outside the viewport, the side being moved towards first
+        ring = [
+            (cx, cy, cz)
+            for cy in range(chunksHeightRange_cx.start - 1, chunksHeightRange_cx.stop + 1)
+            for cx in range(chunksWidthRange_cx.start - 1, chunksWidthRange_cx.stop + 1)
+            if cx not in chunksWidthRange_cx or cy not in chunksHeightRange_cx
+        ]
+        centerX_cx = (chunksWidthRange_cx.start + chunksWidthRange_cx.stop - 1) / 2
+        centerY_cx = (chunksHeightRange_cx.start + chunksHeightRange_cx.stop - 1) / 2
+        ring.sort(key=lambda coords_cx: -((coords_cx[0] - centerX_cx) * heading[0] + (coords_cx[1] - centerY_cx) * heading[1]))
+        for coords_cx in ring:
+            self.request(coords_cx)
+
+    def shutdown(self):
+        self.pool.shutdown(wait=False, cancel_futures=True)
+        self.pending.clear()
@@ -1,84 +1,158 @@
 import pygame, os, time, random
+from concurrent.futures import ThreadPoolExecutor
 from game import World, Entity
-import tileset, renderer, input, ui, change_surface
+import tileset, renderer, input, ui, change_surface, loader, fov, minimap
+from instrument import INSTRUMENTS
 from constants import FrozenConstants as FC
 from constants import RuntimeConfig
 
 
+def open_world(config: RuntimeConfig) -> World:
+    # only reads level.dat for region worlds, so the cost does not grow with the number of chunks
+    if os.path.isdir(FC.WORLD_DIRNAME):
+        INSTRUMENTS.info("found %s, loading", FC.WORLD_DIRNAME)
+        world = World.load(FC.WORLD_DIRNAME, FC.WORLD_RESIDENT_CHUNKS)
+        if world is None:
+            INSTRUMENTS.warning("unable to open %s", FC.WORLD_DIRNAME)
+    elif os.path.exists(FC.WORLD_FILENAME):
+        INSTRUMENTS.info("found legacy %s, converting to %s", FC.WORLD_FILENAME, FC.WORLD_DIRNAME)
+        world = World.load(FC.WORLD_FILENAME)
+        if world is None:
+            INSTRUMENTS.warning("unable to open %s", FC.WORLD_FILENAME)
+        else:
+            world.save(FC.WORLD_DIRNAME)
+    else:
+        INSTRUMENTS.info("%s does not exist", FC.WORLD_DIRNAME)
+        world = World(
+            FC.WORLD_WIDTH_cx,
+            FC.WORLD_HEIGHT_cx,
+            FC.WORLD_DEPTH_ux,
+            FC.CHUNKS_SIDE_LEN_ux,
+            resident_chunks=FC.WORLD_RESIDENT_CHUNKS,
+            seed=config.WORLD_SEED
+            )
+        world.save(FC.WORLD_DIRNAME)
+        INSTRUMENTS.info("%s generated and saved", FC.WORLD_DIRNAME)
+    return world
+
 def main():
+    startTime_s = time.perf_counter()
     os.chdir(os.path.dirname(os.path.abspath(__file__)))
     #get this scripts path, turn it absolute(from root) get the name of the directory its in and make that the working directory (/projectName/src)
 
+    CONFIG = RuntimeConfig()
+    INSTRUMENTS.level = CONFIG.LOG_LEVEL
+    INSTRUMENTS.info("loaded configs")
+
+    # the world is opened on a worker thread while the window and tilesets are set up
+    startupPool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="world-open")
+    worldFuture = startupPool.submit(open_world, CONFIG)
+
     pygame.init()
     pygame.key.set_repeat(FC.KEY_REPEAT_DELAY,FC.KEY_REPEAT_INTERVAL)
 
     display = pygame.display.set_mode(FC.DISPLAY_DIMENSIONS) #make window with following dimensions
     pygame.display.set_caption("doodoo") #call window this
-    
-    #ASCII_8x8 = tileset.generateScaledTilesets(FC.ZOOM_SCALES,tileset.load_tileset("8x8_ascii.png",(8,8))) #8x8 font ascii tiles
-
-    CONFIG = RuntimeConfig()
-    print(f"loaded configs")
-
-    if os.path.exists(FC.WORLD_FILENAME):
-        print(f"found {FC.WORLD_FILENAME}, loading")
-        PLAY_WORLD = World.load(FC.WORLD_FILENAME)
-        if PLAY_WORLD is None:
-            print(f"unable to open {FC.WORLD_FILENAME}")
-            quit()
-    else:
-        print(f"{FC.WORLD_FILENAME} does not exist")
-        PLAY_WORLD = World(
-            FC.WORLD_WIDTH_cx,
-            FC.WORLD_HEIGHT_cx,
-            FC.WORLD_HEIGHT_cx,
-            FC.CHUNKS_SIDE_LEN_ux
-            )
-        World.save(PLAY_WORLD,FC.WORLD_FILENAME)
-        print(f"{FC.WORLD_FILENAME} generated and saved")
 
     PLAY_RECT = pygame.Rect(FC.PLAY_AREA_TOPLEFT,FC.PLAY_AREA_DIMENSIONS) #designate play area
-    print("built user interface")
+    INSTRUMENTS.info("built user interface")
     
-    PLAY_TILES = tileset.generateScaledTilesets(FC.ZOOM_SCALES,tileset.load_tileset(FC.PLAY_TILES_FILENAME,FC.PLAY_TILES_DIMENSIONS))
-    print(f"loaded tileset {FC.PLAY_TILES_FILENAME}")
+    PLAY_TILES = tileset.load_tileset(FC.PLAY_TILES_FILENAME,FC.PLAY_TILES_DIMENSIONS) # other zooms are scaled from rendered chunks
+    INSTRUMENTS.info("loaded tileset %s", FC.PLAY_TILES_FILENAME)
+
+    OVERLAY = ui.textbox(PLAY_RECT, "", tileset.load_tileset(FC.OVERLAY_FONT_FILENAME,FC.OVERLAY_FONT_DIMENSIONS)) # F3 instrumentation readout
+
+    PLAY_WORLD = worldFuture.result()
+    startupPool.shutdown()
+    if PLAY_WORLD is None:
+        pygame.quit()
+        quit()
+    INSTRUMENTS.info("world ready after %.0f ms", (time.perf_counter() - startTime_s)*1000)
+
+    CHUNK_LOADER = loader.ChunkLoader(PLAY_WORLD, FC.CHUNK_LOADER_WORKERS)
+    INSTRUMENTS.info("started chunk loader")
 
-    RENDERER = renderer.Renderer(PLAY_RECT,PLAY_TILES,PLAY_WORLD,FC.ZOOM_SCALES)
-    print("initialized renderer")
+    RENDERER = renderer.Renderer(PLAY_RECT,PLAY_TILES,PLAY_WORLD,FC.ZOOM_SCALES,FC.RENDER_CACHE_BUDGET_MB*2**20)
+    INSTRUMENTS.info("initialized renderer")
+    RENDERER.fov = fov.FieldOfView(PLAY_WORLD, FC.FOV_RADIUS_ux)
+    RENDERER.minimap = minimap.Minimap(PLAY_WORLD, PLAY_TILES, FC.MINIMAP_CELL_px, FC.MINIMAP_SPAN_cx)
 
     if FC.PLAYER_ENTITY_NAME not in PLAY_WORLD.entity_index:
-        print("no player entity found")
+        INSTRUMENTS.warning("no player entity found")
         PLAYER_ENTITY = Entity(
             PLAY_WORLD,
             FC.PLAYER_ENTITY_NAME,
             CONFIG.PLAYER_ENTITY_TILE_ID,
             FC.PLAYER_SPAWN_COORDS_ux
             )
-        World.save(PLAY_WORLD)
+        PLAY_WORLD.save(FC.WORLD_DIRNAME, background=True)
     else:
         PLAYER_ENTITY = PLAY_WORLD.entity_index[FC.PLAYER_ENTITY_NAME]
-        print(f"found player entity at {PLAYER_ENTITY.coordinates_ux}")
+        INSTRUMENTS.info("found player entity at %s", PLAYER_ENTITY.coordinates_ux)
+
+    # the first frame needs only the player's own chunk, its neighbours stream in behind placeholders
+    PLAY_WORLD.getChunkFromUX(PLAYER_ENTITY.coordinates_ux)
 
     INPUT_HANDLER = input.InputHandler(PLAYER_ENTITY,PLAY_WORLD,RENDERER)
-    print("initialized input handler")
+    INSTRUMENTS.info("initialized input handler")
+
+    # anything else (mouse motion, focus, ...) would only wake the loop for nothing
+    pygame.event.set_blocked(None)
+    pygame.event.set_allowed([pygame.QUIT, pygame.KEYDOWN, pygame.WINDOWEXPOSED])
+    CLOCK = pygame.time.Clock()
 
     running = True
     updateRender = True
+    fullUpdate = True # the whole window, not just PLAY_RECT, needs presenting
 
     while running:
-        for event in pygame.event.get():
+        if updateRender:
+            events = pygame.event.get()
+        else:
+            # sleep until input arrives, waking periodically only while chunks are loading or a save is being written
+            events = [pygame.event.wait(FC.LOADER_POLL_MS if CHUNK_LOADER.pending or PLAY_WORLD.pending_saves else 0)] + pygame.event.get()
+
+        for event in events: # everything queued this frame is applied before a single render
             if event.type == pygame.QUIT:
                 running = False
-                World.save(PLAY_WORLD)
-            if event.type == pygame.KEYDOWN:
-                updateRender = INPUT_HANDLER.handleKeydown(event.key)
+                if INPUT_HANDLER.recording is not None:
+                    INPUT_HANDLER.stopRecording()
+                PLAY_WORLD.save(FC.WORLD_DIRNAME)
+            elif event.type == pygame.KEYDOWN:
+                updateRender |= INPUT_HANDLER.handleKeydown(event.key)
+            elif event.type == pygame.WINDOWEXPOSED:
+                updateRender = fullUpdate = True
+        if not running:
+            break
+
+        if CHUNK_LOADER.poll():
+            updateRender = True # placeholders can be replaced
+        PLAY_WORLD.pollSaves()
 
         if updateRender:
+            frameStart_s = time.perf_counter()
+            PLAY_WORLD.pinAround(PLAYER_ENTITY.coordinates_ux, FC.WORLD_PINNED_RADIUS_cx)
             display.fill((0,0,0),PLAY_RECT)
-            display.blit(RENDERER.render(PLAYER_ENTITY.coordinates_ux),PLAY_RECT)
-            pygame.display.flip()
+            RENDERER.render(PLAYER_ENTITY.coordinates_ux, PLAYER_ENTITY.last_move_ux, display)
+            if INSTRUMENTS.enabled:
+                INSTRUMENTS.gauge("world.resident", len(PLAY_WORLD.chunks))
+                INSTRUMENTS.gauge("world.evictions", PLAY_WORLD.chunks.evictions)
+                OVERLAY.string = "\n".join(INSTRUMENTS.overlayLines()) # figures are from the frames before this one
+                OVERLAY.draw(display)
+            if fullUpdate:
+                pygame.display.flip()
+                fullUpdate = False
+            else:
+                pygame.display.update(PLAY_RECT) # nothing outside the play area changes
+            INSTRUMENTS.frame(time.perf_counter() - frameStart_s)
+            if startTime_s is not None:
+                INSTRUMENTS.info("first frame after %.0f ms", (time.perf_counter() - startTime_s)*1000)
+                startTime_s = None
             updateRender = False
-        
+            CLOCK.tick(FC.MAX_FPS) # key repeats arriving faster than this pile up and are coalesced next frame
+
+    CHUNK_LOADER.shutdown()
+    PLAY_WORLD.store.close() # waits for the writer thread
     pygame.quit()
 
 if __name__ == "__main__":
@@ -0,0 +1,101 @@
+import numpy
+import pygame
+import weakref
+from collections import OrderedDict
+from game import World
+
+UNKNOWN_COLOR = (24, 24, 24) # chunks that are neither resident nor drawn before
+MARKER_COLOR = (255, 255, 255)
+
+def tilePalette(tileset: list[pygame.Surface]) -> numpy.ndarray:
+    # the average opaque colour of every tile, indexed [terrainID, rgb] like Chunk.terrain values
+    palette = numpy.zeros((256, 3), dtype=numpy.uint8)
+    for tileID, tile in enumerate(tileset[:len(palette)]):
+        rgb = pygame.surfarray.array3d(tile).reshape(-1, 3)
+        alpha = pygame.surfarray.array_alpha(tile).reshape(-1).astype(numpy.float64)
+        if alpha.sum() > 0:
+            palette[tileID] = (rgb * alpha[:, numpy.newaxis]).sum(axis=0) / alpha.sum()
+    return palette
+
+class Minimap:
+    # an overview of one z layer at cellSize_px pixels per cell, terrain layers go straight to pixels through a palette
+    # every chunk layer is cached as its own tile, redrawn only once its chunk's terrain or passability revision moves on
+    def __init__(self, world: World, tileset: list[pygame.Surface], cellSize_px=1, span_cx=8, capacity=4096):
+        self.world = world
+        self.cell_size = cellSize_px
+        self.span_cx = span_cx # chunks shown along each side
+        self.capacity = capacity
+        self.palette = tilePalette(tileset)
+        self.tiles = OrderedDict() # Format: {(cx, cy, uz): (pygame.Surface, weakref to the Chunk, terrain_revision, passable_revision)} least recently used first
+        self.buffer = None # the composited overview, reused while its size stays the same
+        self.builds = 0
+
+    def _tile(self, key: tuple[int, int, int], load: bool) -> pygame.Surface:
+        # a chunk that is no longer resident cannot have changed, its last tile is still right
+        cx, cy, uz = key
+        chunkKey = (cx, cy, uz // self.world.chunk_size_ux)
+        chunk = self.world.chunks.get(chunkKey)
+        cached = self.tiles.get(key)
+        if cached is not None and (chunk is None or (cached[1]() is chunk and cached[2:] == (chunk.terrain_revision, chunk.passable_revision))):
+            self.tiles.move_to_end(key)
+            return cached[0]
+        if chunk is None and load:
+            chunk = self.world.getChunkFromCX(chunkKey)
+        if chunk is None:
+            return None
+        layerZ_ux = uz % self.world.chunk_size_ux
+        rgb = self.palette[chunk.terrain[layerZ_ux]] # [y, x, rgb]
+        rgb[~chunk.passable[layerZ_ux]] //= 2 # impassable cells are drawn darker
+        if self.cell_size > 1:
+            rgb = rgb.repeat(self.cell_size, axis=0).repeat(self.cell_size, axis=1)
+        tile = pygame.surfarray.make_surface(rgb.transpose(1, 0, 2)) # surfarray is indexed [x, y]
+        self.tiles[key] = (tile, weakref.ref(chunk), chunk.terrain_revision, chunk.passable_revision)
+        self.tiles.move_to_end(key)
+        if len(self.tiles) > self.capacity:
+            self.tiles.popitem(last=False)
+        self.builds += 1
+        return tile
+
+    def origin(self, center_ux: tuple[int, int, int], span_cx: int = None) -> tuple[int, int]:
+        # top left chunk of the overview, kept inside bounded worlds so a whole 8x8 layer fits a span of 8
+        span_cx = self.span_cx if span_cx is None else span_cx
+        origin = []
+        for axis in (0, 1):
+            start_cx = center_ux[axis] // self.world.chunk_size_ux - span_cx // 2
+            limit_cx = self.world.dimensions_chunks[axis]
+            if limit_cx is not None:
+                start_cx = max(0, min(start_cx, limit_cx - span_cx))
+            origin.append(start_cx)
+        return tuple(origin)
+
+    def surface(self, center_ux: tuple[int, int, int], span_cx: int = None, load=False) -> pygame.Surface:
+        # span_cx chunks a side of center_ux's layer, only resident chunks are drawn unless load is set
+        span_cx = self.span_cx if span_cx is None else span_cx
+        tileSide_px = self.world.chunk_size_ux * self.cell_size
+        size_px = (span_cx * tileSide_px, span_cx * tileSide_px)
+        if self.buffer is None or self.buffer.get_size() != size_px:
+            self.buffer = pygame.Surface(size_px)
+        self.buffer.fill(UNKNOWN_COLOR)
+        startX_cx, startY_cx = self.origin(center_ux, span_cx)
+        tileBlits = []
+        for y in range(span_cx):
+            for x in range(span_cx):
+                tile = self._tile((startX_cx + x, startY_cx + y, center_ux[2]), load)
+                if tile is not None:
+                    tileBlits.append((tile, (x * tileSide_px, y * tileSide_px)))
+        self.buffer.blits(tileBlits, doreturn=False)
+        return self.buffer
+
+    def draw(self, target: pygame.Surface, topleft_px: tuple[int, int], center_ux: tuple[int, int, int], markers=()) -> pygame.Rect:
+        # markers are (x, y, z) cells highlighted on top, e.g. the player
+        surface = self.surface(center_ux)
+        rect = target.blit(surface, topleft_px)
+        startX_cx, startY_cx = self.origin(center_ux)
+        left_ux, top_ux = startX_cx * self.world.chunk_size_ux, startY_cx * self.world.chunk_size_ux
+        markerSide_px = max(2, self.cell_size)
+        for x, y, z in markers:
+            if z == center_ux[2]:
+                markerRect = pygame.Rect(0, 0, markerSide_px, markerSide_px)
+                markerRect.center = (rect.left + (x - left_ux) * self.cell_size + self.cell_size // 2, rect.top + (y - top_ux) * self.cell_size + self.cell_size // 2)
+                target.fill(MARKER_COLOR, markerRect.clip(rect))
+        return rect
@@ -0,0 +1,327 @@
+import heapq
+from collections import OrderedDict, deque
+import numpy
+from game import World
+from instrument import INSTRUMENTS
+
+# paths stay on one z layer, a step to any of the 8 neighbours is one move like Entity.move
+# HPA*: every chunk layer is a cluster joined to its neighbours by portals on their shared edges, a query
+# searches cell by cell only inside the start and goal clusters and portal to portal everywhere else
+
+STEPS = ((1, 0), (-1, 0), (0, 1), (0, -1), (1, 1), (-1, 1), (1, -1), (-1, -1)) # straight first, so ties go straight
+PORTAL_SPLIT_UX = 6 # openings at least this wide get a portal at each end instead of one in the middle
+RING = ((0, 0), (-1, 0), (1, 0), (0, -1), (0, 1), (-1, -1), (1, -1), (-1, 1), (1, 1)) # a cluster's chunk, then its neighbours
+_RING_DESTINATION = {-1: slice(0, 1), 0: slice(1, -1), 1: slice(-1, None)}
+_RING_SOURCE = {-1: slice(-1, None), 0: slice(None), 1: slice(0, 1)}
+
+def _grid(passable: numpy.ndarray) -> tuple[list, int]:
+    # flattened [y, x] with a wall all around, so neighbour lookups never need bounds checks
+    height, width = passable.shape
+    padded = numpy.zeros((height + 2, width + 2), dtype=numpy.bool_)
+    padded[1:-1, 1:-1] = passable
+    return padded.ravel().tolist(), width + 2
+
+def _offsets(width: int) -> list[int]:
+    return [dy*width + dx for dx, dy in STEPS]
+
+def _distances(cells: list, width: int, sources: list[int]) -> list[int]:
+    # moves from the nearest source to every cell of a _grid, -1 where unreachable
+    distance = [-1]*len(cells)
+    offsets = _offsets(width)
+    for source in sources:
+        distance[source] = 0
+    queue = deque(sources)
+    while queue:
+        index = queue.popleft()
+        nextDistance = distance[index] + 1
+        for offset in offsets:
+            neighbour = index + offset
+            if cells[neighbour] and distance[neighbour] < 0:
+                distance[neighbour] = nextDistance
+                queue.append(neighbour)
+    return distance
+
+def _descend(distance: list, width: int, index: int) -> list[int]:
+    # from index down to the source it was reached from, one cell per move
+    path = [index]
+    offsets = _offsets(width)
+    while distance[index] > 0:
+        for offset in offsets:
+            if distance[index + offset] == distance[index] - 1:
+                index += offset
+                break
+        path.append(index)
+    return path
+
+def _openings(shared: list) -> list[int]:
+    # portal positions along one edge, shared[i] is True where both sides of the edge are passable
+    positions = []
+    start = None
+    for position, isOpen in enumerate(shared + [False]):
+        if isOpen and start is None:
+            start = position
+        elif not isOpen and start is not None:
+            end = position - 1
+            positions += [start, end] if end - start + 1 >= PORTAL_SPLIT_UX else [(start + end)//2]
+            start = None
+    return positions
+
+def _crossings(mine: list, theirs: list) -> list[tuple[int, int]]:
+    # (position, position across) pairs along one edge of a cluster's ring, only mine[1:-1] are the cluster's own cells
+    # straight openings get one or two, a diagonal step only gets its own where no straight one is beside it
+    shared = [a and b for a, b in zip(mine, theirs)]
+    crossings = [(position + 1, position + 1) for position in _openings(shared[1:-1])]
+    for position in range(1, len(mine) - 1):
+        if mine[position] and not shared[position]:
+            for other in (position - 1, position + 1):
+                if theirs[other] and not shared[other]:
+                    crossings.append((position, other))
+    return crossings
+
+def _token(chunk) -> bytes:
+    # what the chunk's passability looks like rather than which object holds it, so a chunk evicted and
+    # paged back in unchanged keeps its clusters, and caches never keep evicted chunks alive
+    return None if chunk is None else chunk.passableDigest()
+
+def _current(token: bytes, chunk) -> bool:
+    return token == _token(chunk)
+
+class _Window:
+    # a rectangle of one z layer as a _grid, global coords in and out
+    def __init__(self, passable: numpy.ndarray, left_ux: int, top_ux: int, z_ux: int):
+        self.cells, self.width = _grid(passable)
+        self.left_ux = left_ux
+        self.top_ux = top_ux
+        self.z_ux = z_ux
+        self.height = passable.shape[0]
+
+    def index(self, coords_ux: tuple[int, int, int]) -> int:
+        return (coords_ux[1] - self.top_ux + 1)*self.width + coords_ux[0] - self.left_ux + 1
+
+    def coords(self, index: int) -> tuple[int, int, int]:
+        y, x = divmod(index, self.width)
+        return (self.left_ux + x - 1, self.top_ux + y - 1, self.z_ux)
+
+    def contains(self, coords_ux: tuple[int, int, int]) -> bool:
+        return (coords_ux[2] == self.z_ux and 0 <= coords_ux[0] - self.left_ux < self.width - 2
+                and 0 <= coords_ux[1] - self.top_ux < self.height)
+
+    def isOpen(self, coords_ux: tuple[int, int, int]) -> bool:
+        return self.contains(coords_ux) and self.cells[self.index(coords_ux)]
+
+class _Cluster(_Window):
+    # one chunk layer, its portals and whatever has been worked out between them so far
+    def __init__(self, passable: numpy.ndarray, left_ux: int, top_ux: int, z_ux: int, portals: dict, tokens: tuple):
+        super().__init__(passable, left_ux, top_ux, z_ux)
+        self.portals = portals # Format: {(x, y, z): [(x, y, z) one move away in the neighbouring cluster]}
+        self.tokens = tokens # the chunk and its neighbours in RING order as built from, see _token
+        self.edges = {} # Format: {portal: [(other portal, moves)]} filled the first time a search leaves the portal
+        self.paths = {} # Format: {(portal, portal): [(x, y, z)]} both ends included
+
+    def distancesFrom(self, coords_ux: tuple[int, int, int]) -> list[int]:
+        return _distances(self.cells, self.width, [self.index(coords_ux)])
+
+    def neighbours(self, portal: tuple[int, int, int]) -> list:
+        edges = self.edges.get(portal)
+        if edges is None:
+            distance = self.distancesFrom(portal)
+            edges = self.edges[portal] = [
+                (other, distance[self.index(other)])
+                for other in self.portals if distance[self.index(other)] > 0
+            ]
+        return edges
+
+    def path(self, fromPortal: tuple[int, int, int], toPortal: tuple[int, int, int]) -> list[tuple[int, int, int]]:
+        path = self.paths.get((fromPortal, toPortal))
+        if path is None:
+            distance = self.distancesFrom(toPortal)
+            path = self.paths[(fromPortal, toPortal)] = [self.coords(index) for index in _descend(distance, self.width, self.index(fromPortal))]
+        return path
+
+class FlowField(_Window):
+    # moves to the goal from every cell of a square of chunk layers around it, one search shared by
+    # every entity heading there, each of them only looks up its next step
+    def __init__(self, goal_ux: tuple[int, int, int], passable: numpy.ndarray, left_ux: int, top_ux: int, tokens: dict):
+        super().__init__(passable, left_ux, top_ux, goal_ux[2])
+        self.goal_ux = goal_ux
+        self.tokens = tokens # Format: {(cx, cy, uz): _token} of every chunk layer in the window
+        self.moves = _distances(self.cells, self.width, [self.index(goal_ux)] if self.isOpen(goal_ux) else [])
+        self.offsets = _offsets(self.width)
+
+    def distance(self, coords_ux: tuple[int, int, int]) -> int:
+        # moves left to the goal, None outside the window or where the goal cannot be reached
+        if not self.contains(coords_ux):
+            return None
+        moves = self.moves[self.index(coords_ux)]
+        return None if moves < 0 else moves
+
+    def step(self, coords_ux: tuple[int, int, int]) -> tuple[int, int, int]:
+        # (dx, dy, 0) for Entity.move or TickScheduler.queueMove, None at the goal or where it cannot be reached
+        moves = self.distance(coords_ux)
+        if not moves:
+            return None
+        index = self.index(coords_ux)
+        for (dx, dy), offset in zip(STEPS, self.offsets):
+            if self.moves[index + offset] == moves - 1:
+                return (dx, dy, 0)
+
+class Pathfinder:
+    # clusters and flow fields are rebuilt lazily once the passability of a chunk they were built from changes,
+    # so terrain edits only cost the chunks they touched and evictions cost nothing
+    def __init__(self, world: World, clusterCapacity=4096, flowFieldCapacity=16):
+        self.world = world
+        self.cluster_capacity = clusterCapacity
+        self.flow_field_capacity = flowFieldCapacity
+        self.clusters = OrderedDict() # Format: {(cx, cy, uz): _Cluster} least recently used first
+        self.flow_fields = OrderedDict() # Format: {(goal, radius_cx): FlowField} least recently used first
+        self.cluster_builds = 0
+        self.flow_field_builds = 0
+
+    def _clusterKey(self, coords_ux: tuple[int, int, int]) -> tuple[int, int, int]:
+        return (coords_ux[0]//self.world.chunk_size_ux, coords_ux[1]//self.world.chunk_size_ux, coords_ux[2])
+
+    def _chunk(self, key: tuple[int, int, int]):
+        # keys are (cx, cy, uz) like the renderer's, None outside the world
+        return self.world.getChunkFromCX((key[0], key[1], key[2]//self.world.chunk_size_ux))
+
+    def _layer(self, chunk, z_ux: int) -> numpy.ndarray:
+        return chunk.passable[z_ux % self.world.chunk_size_ux]
+
+    def _cluster(self, key: tuple[int, int, int]) -> _Cluster:
+        cx, cy, uz = key
+        chunks = [self._chunk((cx + dx, cy + dy, uz)) for dx, dy in RING]
+        cluster = self.clusters.get(key)
+        if cluster is not None and all(map(_current, cluster.tokens, chunks)):
+            self.clusters.move_to_end(key)
+            return cluster
+        if chunks[0] is None:
+            return None
+
+        # the layer plus the first cell of every neighbour around it, outside the world stays closed
+        chunkSize_ux = self.world.chunk_size_ux
+        ring = numpy.zeros((chunkSize_ux + 2, chunkSize_ux + 2), dtype=numpy.bool_)
+        for (dx, dy), chunk in zip(RING, chunks):
+            if chunk is not None:
+                ring[_RING_DESTINATION[dy], _RING_DESTINATION[dx]] = self._layer(chunk, uz)[_RING_SOURCE[dy], _RING_SOURCE[dx]]
+        left_ux, top_ux = cx*chunkSize_ux, cy*chunkSize_ux
+        right_ux, bottom_ux = left_ux + chunkSize_ux - 1, top_ux + chunkSize_ux - 1
+        portals = {}
+        for mine, theirs, inside, across in (
+                (ring[:, 1], ring[:, 0], lambda i: (left_ux, top_ux + i - 1, uz), lambda i: (left_ux - 1, top_ux + i - 1, uz)),
+                (ring[:, -2], ring[:, -1], lambda i: (right_ux, top_ux + i - 1, uz), lambda i: (right_ux + 1, top_ux + i - 1, uz)),
+                (ring[1, :], ring[0, :], lambda i: (left_ux + i - 1, top_ux, uz), lambda i: (left_ux + i - 1, top_ux - 1, uz)),
+                (ring[-2, :], ring[-1, :], lambda i: (left_ux + i - 1, bottom_ux, uz), lambda i: (left_ux + i - 1, bottom_ux + 1, uz))):
+            for position, other in _crossings(mine.tolist(), theirs.tolist()):
+                partners = portals.setdefault(inside(position), [])
+                if across(other) not in partners: # corner steps show up on two edges
+                    partners.append(across(other))
+
+        cluster = self.clusters[key] = _Cluster(ring[1:-1, 1:-1], left_ux, top_ux, uz, portals, tuple(map(_token, chunks)))
+        self.clusters.move_to_end(key)
+        if len(self.clusters) > self.cluster_capacity:
+            self.clusters.popitem(last=False)
+        self.cluster_builds += 1
+        INSTRUMENTS.count("path.cluster_builds")
+        return cluster
+
+    def findPath(self, start_ux: tuple[int, int, int], goal_ux: tuple[int, int, int]) -> list[tuple[int, int, int]]:
+        # [(x, y, z)] from start to goal, both included, None when the goal cannot be reached on the start's layer
+        # near optimal rather than optimal, routes can only cross between chunks at portals
+        with INSTRUMENTS.timer("path.find"):
+            path = self._find(tuple(start_ux), tuple(goal_ux))
+        INSTRUMENTS.count("path.queries")
+        return path
+
+    def _find(self, start: tuple[int, int, int], goal: tuple[int, int, int]) -> list[tuple[int, int, int]]:
+        if start[2] != goal[2]:
+            return None
+        clusters = {} # Format: {(cx, cy, uz): _Cluster} checked once per query
+        def clusterOf(coords_ux):
+            key = self._clusterKey(coords_ux)
+            cluster = clusters.get(key)
+            if cluster is None:
+                cluster = clusters[key] = self._cluster(key)
+            return cluster
+        startCluster, goalCluster = clusterOf(start), clusterOf(goal)
+        if startCluster is None or goalCluster is None or not startCluster.isOpen(start) or not goalCluster.isOpen(goal):
+            return None
+        if start == goal:
+            return [start]
+        fromStart = startCluster.distancesFrom(start)
+        toGoal = goalCluster.distancesFrom(goal)
+
+        # A* over portals, start and goal only join the graph for this query
+        moves = {start: 0}
+        previous = {}
+        frontier = []
+        def reach(node, cost, parent):
+            if cost < moves.get(node, cost + 1):
+                moves[node] = cost
+                previous[node] = parent
+                heapq.heappush(frontier, (cost + max(abs(goal[0] - node[0]), abs(goal[1] - node[1])), -cost, node)) # ties go to the node furthest along
+        if startCluster is goalCluster and toGoal[startCluster.index(start)] > 0:
+            reach(goal, toGoal[startCluster.index(start)], start)
+        for portal in startCluster.portals:
+            if fromStart[startCluster.index(portal)] >= 0:
+                reach(portal, fromStart[startCluster.index(portal)], start)
+        while frontier:
+            _, cost, node = heapq.heappop(frontier)
+            cost = -cost
+            if cost > moves[node]:
+                continue
+            if node == goal:
+                return self._refine(previous, start, goal, clusters, fromStart, toGoal)
+            cluster = clusterOf(node)
+            for other, otherMoves in cluster.neighbours(node):
+                reach(other, cost + otherMoves, node)
+            for across in cluster.portals[node]:
+                reach(across, cost + 1, node)
+            if cluster is goalCluster and toGoal[cluster.index(node)] > 0:
+                reach(goal, cost + toGoal[cluster.index(node)], node)
+        return None
+
+    def _refine(self, previous: dict, start: tuple, goal: tuple, clusters: dict, fromStart: list, toGoal: list) -> list:
+        # stitch the portal route back into single moves, portal to portal legs come from the cluster caches
+        route = [goal]
+        while route[-1] != start:
+            route.append(previous[route[-1]])
+        route.reverse()
+        startCluster, goalCluster = clusters[self._clusterKey(start)], clusters[self._clusterKey(goal)]
+        path = [start]
+        for a, b in zip(route, route[1:]):
+            if self._clusterKey(a) != self._clusterKey(b):
+                path.append(b)
+            elif a == start:
+                path.extend(startCluster.coords(index) for index in reversed(_descend(fromStart, startCluster.width, startCluster.index(b))[:-1]))
+            elif b == goal:
+                path.extend(goalCluster.coords(index) for index in _descend(toGoal, goalCluster.width, goalCluster.index(a))[1:])
+            else:
+                path.extend(clusters[self._clusterKey(a)].path(a, b)[1:])
+        return path
+
+    def flowField(self, goal_ux: tuple[int, int, int], radius_cx=2) -> FlowField:
+        # shared by every caller with the same goal and radius until a chunk layer in the window changes passability
+        goal_ux = tuple(goal_ux)
+        gx, gy, uz = self._clusterKey(goal_ux)
+        keys = [(cx, cy, uz) for cy in range(gy - radius_cx, gy + radius_cx + 1) for cx in range(gx - radius_cx, gx + radius_cx + 1)]
+        chunks = {key: self._chunk(key) for key in keys}
+        flowField = self.flow_fields.get((goal_ux, radius_cx))
+        if flowField is not None and all(_current(flowField.tokens[key], chunk) for key, chunk in chunks.items()):
+            self.flow_fields.move_to_end((goal_ux, radius_cx))
+            return flowField
+
+        chunkSize_ux = self.world.chunk_size_ux
+        side_ux = (2*radius_cx + 1)*chunkSize_ux
+        left_ux, top_ux = (gx - radius_cx)*chunkSize_ux, (gy - radius_cx)*chunkSize_ux
+        passable = numpy.zeros((side_ux, side_ux), dtype=numpy.bool_) # outside the world is a wall
+        for (cx, cy, _), chunk in chunks.items():
+            if chunk is not None:
+                x, y = cx*chunkSize_ux - left_ux, cy*chunkSize_ux - top_ux
+                passable[y:y+chunkSize_ux, x:x+chunkSize_ux] = self._layer(chunk, uz)
+        with INSTRUMENTS.timer("path.flow_field"):
+            flowField = self.flow_fields[(goal_ux, radius_cx)] = FlowField(goal_ux, passable, left_ux, top_ux, {key: _token(chunk) for key, chunk in chunks.items()})
+        self.flow_fields.move_to_end((goal_ux, radius_cx))
+        if len(self.flow_fields) > self.flow_field_capacity:
+            self.flow_fields.popitem(last=False)
+        self.flow_field_builds += 1
+        return flowField
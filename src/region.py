@@ -0,0 +1,228 @@
+import os
+import gzip
+import pickle
+import struct
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+
+REGION_SIDE_CX = 8 # regions hold 8x8x8 chunks
+REGION_MAGIC = b"DDRG"
+REGION_VERSION = 2
+REGION_HEADER = struct.Struct("<4sI") # magic, version
+REGION_TABLE_HEADER = struct.Struct("<II") # generation, crc32 of the generation and the entries
+REGION_ENTRY = struct.Struct("<II") # offset, length (in bytes, 0 offset means not stored)
+REGION_V1_ENTRY = struct.Struct("<III") # offset, length, capacity, read only to upgrade older worlds
+REGION_COMPACT_SLACK_B = 64*2**10 # superseded records a region may hold beyond its live ones before it is rewritten
+LEVEL_FILENAME = "level.dat"
+
+def regionKey(coords_cx: tuple[int, int, int]) -> tuple[int, int, int]:
+    return (coords_cx[0] // REGION_SIDE_CX, coords_cx[1] // REGION_SIDE_CX, coords_cx[2] // REGION_SIDE_CX)
+
+def regionIndex(coords_cx: tuple[int, int, int]) -> int:
+    x, y, z = (coord % REGION_SIDE_CX for coord in coords_cx)
+    return (z * REGION_SIDE_CX + y) * REGION_SIDE_CX + x
+
+def _pack_table(generation: int, entries: list[tuple[int, int]]) -> bytes:
+    packedEntries = b"".join(REGION_ENTRY.pack(*entry) for entry in entries)
+    return REGION_TABLE_HEADER.pack(generation, zlib.crc32(struct.pack("<I", generation) + packedEntries)) + packedEntries
+
+class RegionFile:
+    # header, two copies of the offset table and zlib compressed chunk records behind them, opened read only
+    # records are only ever appended, a commit syncs them and then writes the table into the older slot,
+    # so a crash leaves at least one intact table and everything it points at
+    ENTRIES = REGION_SIDE_CX ** 3
+    TABLE_B = REGION_TABLE_HEADER.size + ENTRIES * REGION_ENTRY.size
+    DATA_START_B = REGION_HEADER.size + 2 * TABLE_B
+
+    def __init__(self, path: str):
+        self.path = path
+        self.file = open(path, "rb")
+        magic, self.version = REGION_HEADER.unpack(self.file.read(REGION_HEADER.size))
+        if magic != REGION_MAGIC or self.version not in (1, REGION_VERSION):
+            raise ValueError(f"{path} is not a version 1 or {REGION_VERSION} region file")
+        if self.version == 1: # rewritten as version 2 by the next commit to this region
+            table = self.file.read(RegionFile.ENTRIES * REGION_V1_ENTRY.size)
+            self.entries = [REGION_V1_ENTRY.unpack_from(table, i * REGION_V1_ENTRY.size)[:2] for i in range(RegionFile.ENTRIES)]
+            self.generation, self.slot = 0, 0
+            return
+        tables = []
+        for slot in (0, 1):
+            table = self.file.read(RegionFile.TABLE_B)
+            generation, crc = REGION_TABLE_HEADER.unpack_from(table)
+            if zlib.crc32(struct.pack("<I", generation) + table[REGION_TABLE_HEADER.size:]) == crc:
+                tables.append((generation, slot, table))
+        if not tables:
+            raise ValueError(f"{path} has no intact offset table")
+        self.generation, self.slot, table = max(tables)
+        self.entries = [REGION_ENTRY.unpack_from(table, REGION_TABLE_HEADER.size + i * REGION_ENTRY.size) for i in range(RegionFile.ENTRIES)]
+
+    @staticmethod
+    def tableOffset(slot: int) -> int:
+        return REGION_HEADER.size + slot * RegionFile.TABLE_B
+
+    def readRecord(self, index: int) -> bytes:
+        # still compressed, so callers can decompress outside of any lock
+        offset, length = self.entries[index]
+        if offset == 0:
+            return None
+        self.file.seek(offset)
+        return self.file.read(length)
+
+    def readRecords(self) -> dict[int, bytes]:
+        return {index: self.readRecord(index) for index, entry in enumerate(self.entries) if entry[0] != 0}
+
+    def liveBytes(self) -> int:
+        return sum(length for offset, length in self.entries)
+
+    def close(self):
+        self.file.close()
+
+def _write_atomic(path: str, parts: list[bytes]) -> str:
+    # written and synced under a temporary name, the caller renames it over path when it is safe to
+    temporaryPath = path + ".tmp"
+    with open(temporaryPath, "wb") as f:
+        f.writelines(parts)
+        f.flush()
+        os.fsync(f.fileno())
+    return temporaryPath
+
+def writeRegion(path: str, records: dict[int, bytes]) -> str:
+    # a fresh or compacted region, records are compressed, by regionIndex, packed back to back
+    entries = []
+    offset = RegionFile.DATA_START_B
+    for index in range(RegionFile.ENTRIES):
+        record = records.get(index)
+        if record is None:
+            entries.append((0, 0))
+        else:
+            entries.append((offset, len(record)))
+            offset += len(record)
+    emptyTable = _pack_table(0, [(0, 0)] * RegionFile.ENTRIES)
+    return _write_atomic(path, [REGION_HEADER.pack(REGION_MAGIC, REGION_VERSION), _pack_table(1, entries), emptyTable, *(records[index] for index in sorted(records))])
+
+def appendRecords(region: RegionFile, records: dict[int, bytes]) -> tuple[list, int, int, int]:
+    # returns (entries, generation, slot, file size) for the caller to publish once it holds the store's lock
+    entries = list(region.entries)
+    with open(region.path, "r+b") as f:
+        end = f.seek(0, os.SEEK_END)
+        for index, record in records.items():
+            entries[index] = (end, len(record))
+            f.write(record)
+            end += len(record)
+        f.flush()
+        os.fsync(f.fileno()) # records are on disk before any table points at them
+        generation, slot = region.generation + 1, 1 - region.slot
+        f.seek(RegionFile.tableOffset(slot))
+        f.write(_pack_table(generation, entries))
+        f.flush()
+        os.fsync(f.fileno())
+    return entries, generation, slot, end
+
+class WorldStore:
+    # a world directory: level.dat for world wide metadata plus one region file per 8^3 chunks
+    # writes only queue a snapshot, a single writer thread compresses them and swaps in the new files
+    def __init__(self, path: str):
+        self.path = path
+        self.regions = {} # Format: {(rx, ry, rz): RegionFile}
+        self.absent_regions = set() # region files known not to exist, so generated chunks skip the filesystem
+        self.pending = {} # Format: {(cx, cy, cz): bytes} chunk snapshots not on disk yet, read before the region files
+        self.lock = threading.Lock() # chunk loader threads read while the writer swaps files
+        self.writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix="world-writer")
+        os.makedirs(os.path.join(path, "regions"), exist_ok=True)
+
+    def _region_path(self, key: tuple[int, int, int]) -> str:
+        return os.path.join(self.path, "regions", f"r.{key[0]}.{key[1]}.{key[2]}.drg")
+
+    def _region(self, key: tuple[int, int, int]) -> RegionFile:
+        region = self.regions.get(key)
+        if region is None:
+            if key in self.absent_regions:
+                return None
+            regionPath = self._region_path(key)
+            if not os.path.exists(regionPath):
+                self.absent_regions.add(key)
+                return None
+            region = RegionFile(regionPath)
+            self.regions[key] = region
+        return region
+
+    def readChunk(self, coords_cx: tuple[int, int, int]) -> bytes:
+        with self.lock:
+            data = self.pending.get(coords_cx)
+            if data is not None:
+                return data
+            region = self._region(regionKey(coords_cx))
+            record = None if region is None else region.readRecord(regionIndex(coords_cx))
+        return None if record is None else zlib.decompress(record)
+
+    def writeChunk(self, coords_cx: tuple[int, int, int], data: bytes):
+        # data must not change afterwards, Chunk.toBytes already returns a copy
+        with self.lock:
+            self.pending[coords_cx] = data
+
+    def readLevel(self) -> dict:
+        with gzip.open(os.path.join(self.path, LEVEL_FILENAME), "rb") as f:
+            return pickle.load(f)
+
+    def _commit(self, level: dict) -> int:
+        # runs on the writer thread, picks up every snapshot queued until now
+        with self.lock:
+            batch = dict(self.pending)
+        byRegion = {} # Format: {(rx, ry, rz): {index: compressed record}}
+        for coords_cx, data in batch.items():
+            byRegion.setdefault(regionKey(coords_cx), {})[regionIndex(coords_cx)] = zlib.compress(data)
+        for key, updates in byRegion.items():
+            with self.lock:
+                region = self._region(key)
+            if region is not None and region.version == REGION_VERSION:
+                # only what changed is written, readers keep using the old table until the new one is published
+                entries, generation, slot, size_b = appendRecords(region, updates)
+                with self.lock:
+                    region.entries, region.generation, region.slot = entries, generation, slot
+                    self._drop_pending(batch, key)
+                if size_b - RegionFile.DATA_START_B <= 2 * region.liveBytes() + REGION_COMPACT_SLACK_B:
+                    continue
+                updates = {}
+            # new, version 1 or mostly superseded records, the region is rewritten whole and swapped in
+            with self.lock:
+                region = self._region(key)
+                records = {} if region is None else region.readRecords()
+            records.update(updates)
+            temporaryPath = writeRegion(self._region_path(key), records)
+            with self.lock:
+                region = self.regions.pop(key, None)
+                if region is not None:
+                    region.close()
+                os.replace(temporaryPath, self._region_path(key))
+                self.absent_regions.discard(key)
+                self._drop_pending(batch, key)
+        if level is not None:
+            levelPath = os.path.join(self.path, LEVEL_FILENAME)
+            os.replace(_write_atomic(levelPath, [gzip.compress(pickle.dumps(level, protocol=pickle.HIGHEST_PROTOCOL))]), levelPath)
+        return len(batch)
+
+    def _drop_pending(self, batch: dict, key: tuple[int, int, int]):
+        # call with the lock held once the region holding key is updated on disk
+        for coords_cx, data in batch.items():
+            if regionKey(coords_cx) == key and self.pending.get(coords_cx) is data: # not replaced by a newer snapshot
+                del self.pending[coords_cx]
+
+    def commitAsync(self, level: dict = None) -> Future:
+        # the future's result is the number of chunks written, level is written last when given
+        return self.writer.submit(self._commit, level)
+
+    def commit(self, level: dict = None) -> int:
+        return self.commitAsync(level).result()
+
+    def flush(self):
+        self.commit()
+
+    def close(self):
+        self.writer.shutdown(wait=True)
+        if self.pending: # left by evictions after the last commit
+            self._commit(None)
+        with self.lock:
+            for region in self.regions.values():
+                region.close()
+            self.regions.clear()
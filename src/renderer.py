@@ -1,7 +1,14 @@
 import pygame
 from game import World
+from instrument import INSTRUMENTS
+import change_surface
 from dataclasses import dataclass
 from enum import Enum
+from collections import OrderedDict
+
+PLACEHOLDER_COLOR = (24, 24, 24) # drawn where a chunk is still being loaded
+MINIMAP_BORDER_COLOR = (128, 128, 128)
+MINIMAP_MARGIN_px = 4 # between the minimap panel and the edges of the view
 
 class RCode(Enum): #R is short for render
     SUCCESS = 0
@@ -24,81 +31,271 @@ class RResult:
     def __str__(self):
         return f"{self.code} (Code: {self.code.value})"
 
+class SurfaceCache:
+    # byte budgeted chunk surface cache using GreedyDual-Size: every use sets a surface's priority to
+    # inflation + 1/MiB, the lowest priority is evicted first and inflation rises to it, so surfaces
+    # that are both stale and large go first while recently used small ones survive longest
+    def __init__(self, budget_b: int, onEvict=None):
+        self.budget_b = budget_b
+        self.on_evict = onEvict # called with the key of every evicted surface
+        self.surfaces = OrderedDict() # Format: {(cx, cy, uz, zoom): pygame.Surface}
+        self.priorities = {} # Format: {(cx, cy, uz, zoom): float}
+        self.inflation = 0.0
+        self.used_b = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def _surface_bytes(surface: pygame.Surface) -> int:
+        return surface.get_pitch() * surface.get_height()
+
+    def _touch(self, key, surface: pygame.Surface):
+        self.priorities[key] = self.inflation + 2**20 / self._surface_bytes(surface)
+
+    def get(self, key) -> pygame.Surface:
+        surface = self.surfaces.get(key)
+        if surface is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touch(key, surface)
+        return surface
+
+    def put(self, key, surface: pygame.Surface):
+        self.discard(key)
+        self.surfaces[key] = surface
+        self.used_b += self._surface_bytes(surface)
+        self._touch(key, surface)
+        while self.used_b > self.budget_b and len(self.surfaces) > 1:
+            victim = min(self.priorities, key=self.priorities.__getitem__)
+            self.inflation = self.priorities[victim]
+            self.discard(victim)
+            self.evictions += 1
+            if self.on_evict is not None:
+                self.on_evict(victim)
+
+    def discard(self, key):
+        surface = self.surfaces.pop(key, None)
+        if surface is not None:
+            self.used_b -= self._surface_bytes(surface)
+            del self.priorities[key]
+
+    def clear(self):
+        self.surfaces.clear()
+        self.priorities.clear()
+        self.used_b = 0
+
+    def __contains__(self, key) -> bool:
+        return key in self.surfaces
+
+    def __len__(self) -> int:
+        return len(self.surfaces)
+
+    def __str__(self):
+        return (f"surface cache: {self.hits} hits, {self.misses} misses, {self.evictions} evictions, "
+                f"{self.used_b/2**20:.1f}/{self.budget_b/2**20:.0f} MiB in {len(self.surfaces)} surfaces")
+
 class Renderer:
+    NATIVE_ZOOM = 1 # chunks are rasterized from the tileset at this scale, every other zoom is scaled from it
+
     def __init__(
             self,
             boundsRect: pygame.Rect,
-            tileDict: dict[list[pygame.Surface]],
+            tileset: list[pygame.Surface],
             world: World,
-            zoomScales: dict[int]
+            zoomScales: dict[int],
+            cacheBudget_b: int = 192*2**20,
+            recolorCapacity: int = 1024,
             ) -> None:
         self.bounds = boundsRect
-        self.tilesets = tileDict
+        self.tileset = tileset
         self.world = world
         self.zoom_scales = zoomScales
         self.zoom = zoomScales[1]
-        self.tileset = self.tilesets[self.zoom]
         self.debug_mode = False
-        self.good_surfaces = {} # Format: {(cx, cy, uz, zoom)}
+        self.recolor = change_surface.RecolorAtlas(tileset, recolorCapacity) # tinted tiles, built once per (tile, colour)
+        self.terrain_tiles = list(tileset) # Format: [pygame.Surface] by terrainID, recoloured entries replace plain ones
+        self.surface_cache = SurfaceCache(cacheBudget_b, self._on_surface_evicted) # Format: {(cx, cy, uz, zoom): pygame.Surface}
+        self.modified_cells = world.watchModifiedCells() # Format: {(cx, cy, uz): {(x, y)}}
+        self.pending_tiles = {} # Format: {(cx, cy, uz, zoom): {(x, y)}} tiles to patch into a cached surface before it is used again
+        self.tile_positions = [ # in the same order as a raveled terrain layer
+            (x*self.tileset[0].get_width(), y*self.tileset[0].get_height())
+            for y in range(world.chunk_size_ux)
+            for x in range(world.chunk_size_ux)
+        ]
+        self.view_buffer = None # persistent mosaic of the visible chunks, scrolled as the camera moves
+        self.view_origin = None # Format: (startCX, startCY, uz, zoom) of view_buffer
+        self.view_drawn = set() # Format: {(cx, cy)} slots of view_buffer holding their final pixels
+        self.view_dirty = {} # Format: {(cx, cy): {(x, y)}} tiles to copy into view_buffer from the patched chunk surface
+        self.fov = None # optional fov.FieldOfView, chunks out of sight are not rasterized and unseen tiles are covered
+        self.fov_enabled = True
+        self.fog = None # black where the viewer cannot see, covering the last composited part of the view
+        self.fog_key = None # Format: (fov version, view origin, clipped rect)
+        self.minimap = None # optional minimap.Minimap, drawn as a panel in the top right corner of the view
+        self.minimap_enabled = True
+
+    def _on_surface_evicted(self, cache_key: tuple[int,int,int,int]):
+        self.pending_tiles.pop(cache_key, None) # a fresh rasterization will include them
+
+    def _entity_tile(self, entity) -> pygame.Surface:
+        if entity.color is None:
+            return self.tileset[entity.tileID]
+        return self.recolor.get(entity.tileID, entity.color, Renderer.NATIVE_ZOOM)
+
+    def setTerrainColor(self, terrainID: int, color):
+        # recoloured once here, rasterization keeps indexing a plain list
+        if color is None:
+            self.terrain_tiles[terrainID] = self.tileset[terrainID]
+        else:
+            self.terrain_tiles[terrainID] = self.recolor.get(terrainID, color, Renderer.NATIVE_ZOOM).copy() # atlas slots get reused
+        self.surface_cache.clear() # every chunk may contain the terrain
+        self.pending_tiles.clear()
+        self.view_buffer = None
+
+    def _tile_size(self, zoom: int) -> tuple[int,int]:
+        tileWidth_px, tileHeight_px = self.tileset[0].get_size()
+        return (tileWidth_px*zoom, tileHeight_px*zoom)
 
-    def _render_cell(
+    def _rasterize_native(
             self,
-            coords_ux: tuple[int,int,int],
+            chunk_cx: tuple[int,int,int]
             ) -> RResult:
-        cell = self.world.getCell(coords_ux)
-        rSurface = self.tileset[cell.terrainID].copy()
-        if len(cell.entities) > 0:
-            topEntity = cell.entities[0]
-            if self.debug_mode:
-                print(f"rendering entity at {coords_ux}: {topEntity}")
-            rSurface.blit(self.tileset[topEntity.tileID],(0,0))
-        return RResult(rSurface,RCode.SUCCESS)
+        x_cx, y_cx, z_ux = chunk_cx
+        cache_key = (x_cx, y_cx, z_ux, Renderer.NATIVE_ZOOM)
+
+        rSurface = self.surface_cache.get(cache_key)
+        if rSurface is not None:
+            pendingTiles = self.pending_tiles.pop(cache_key, None)
+            if pendingTiles:
+                self._patch_native_tiles(rSurface, chunk_cx, pendingTiles)
+            return RResult(rSurface,RCode.CACHE_HIT)
 
+        worldChunkSize_ux = self.world.chunk_size_ux
+        tileWidth_px, tileHeight_px = self.tileset[0].get_size()
+        rSurface = pygame.Surface((worldChunkSize_ux*tileWidth_px,worldChunkSize_ux*tileHeight_px))
+
+        chunk = self.world.getChunkFromCX((x_cx, y_cx, z_ux // worldChunkSize_ux))
+        layerZ_ux = z_ux % worldChunkSize_ux
+        with INSTRUMENTS.timer("render.rasterize"):
+            terrainLayer = chunk.terrain[layerZ_ux] # [y, x] of terrain IDs, no per cell lookups
+            rSurface.blits(zip(map(self.terrain_tiles.__getitem__, terrainLayer.ravel().tolist()), self.tile_positions), doreturn=False)
+
+            entityBlits = [ # sparse second pass, only cells that actually hold entities
+                (self._entity_tile(next(iter(cellEntities))), (x*tileWidth_px, y*tileHeight_px))
+                for (x, y, z), cellEntities in chunk.entities.items()
+                if z == layerZ_ux
+            ]
+            if entityBlits:
+                rSurface.blits(entityBlits, doreturn=False)
+
+        self.pending_tiles.pop(cache_key, None)
+        self.surface_cache.put(cache_key, rSurface)
+        return RResult(rSurface,RCode.SUCCESS)
 
     def _render_single_chunk(
             self,
             chunk_cx: tuple[int,int,int]
             ) -> RResult:
+        # chunk surface at the current zoom, scaled down the pyramid from the native rasterization when missing
+        if self.zoom == Renderer.NATIVE_ZOOM:
+            return self._rasterize_native(chunk_cx)
 
-        x_cx, y_cx, z_ux = chunk_cx[0], chunk_cx[1], chunk_cx[2]
-
+        x_cx, y_cx, z_ux = chunk_cx
         cache_key = (x_cx, y_cx, z_ux, self.zoom)
-        modified_key = (x_cx, y_cx, z_ux)
 
-        if (cache_key in self.good_surfaces and modified_key not in self.world.modified_chunks):
-            rSurface = self.good_surfaces[cache_key]
+        rSurface = self.surface_cache.get(cache_key)
+        if rSurface is not None:
+            pendingTiles = self.pending_tiles.pop(cache_key, None)
+            if pendingTiles:
+                nativeSurface = self._rasterize_native(chunk_cx).surface
+                self._patch_scaled_tiles(rSurface, nativeSurface, pendingTiles)
             return RResult(rSurface,RCode.CACHE_HIT)
 
-        worldChunkSize_ux = self.world.chunk_size_ux
-        tileWidth_px = self.tileset[0].get_width()
-        tileHeight_px = self.tileset[0].get_height()
-        chunkWidth_px = worldChunkSize_ux*tileWidth_px
-        chunkHeight_px = worldChunkSize_ux*tileHeight_px
+        nativeSurface = self._rasterize_native(chunk_cx).surface
+        with INSTRUMENTS.timer("render.scale"):
+            rSurface = pygame.transform.scale_by(nativeSurface, self.zoom / Renderer.NATIVE_ZOOM)
+        self.pending_tiles.pop(cache_key, None)
+        self.surface_cache.put(cache_key, rSurface)
+        return RResult(rSurface,RCode.SUCCESS)
 
-        rSurface = pygame.Surface((chunkWidth_px,chunkHeight_px))
+    def _draw_tile_grid(self, rSurface: pygame.Surface, left_px: int, top_px: int, x: int, y: int):
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        leftColor = (255,0,255) if x == 0 else (128,128,128) # chunk borders stand out
+        topColor = (255,0,255) if y == 0 else (128,128,128)
+        pygame.draw.line(rSurface,leftColor,(left_px,top_px),(left_px,top_px+tileHeight_px-1))
+        pygame.draw.line(rSurface,topColor,(left_px,top_px),(left_px+tileWidth_px-1,top_px))
 
-        for y in range(worldChunkSize_ux):
-            for x in range(worldChunkSize_ux):
-                tileCoords_px = (x*tileWidth_px,y*tileHeight_px)
-                cellCoords_ux = (x_cx*worldChunkSize_ux+x,y_cx*worldChunkSize_ux+y,z_ux)
-                cellRender = self._render_cell(cellCoords_ux)
-                rSurface.blit(cellRender.surface,tileCoords_px)
+    def _draw_chunk_grid(self, rSurface: pygame.Surface, left_px: int, top_px: int):
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        for y in range(self.world.chunk_size_ux):
+            for x in range(self.world.chunk_size_ux):
+                self._draw_tile_grid(rSurface, left_px + x*tileWidth_px, top_px + y*tileHeight_px, x, y)
 
-        if self.debug_mode:
-            for x in range(worldChunkSize_ux):
-                if x == 0: borderColor = (255,0,255)
-                else: borderColor = (128,128,128)
-                xCoord_px = x*tileWidth_px
-                pygame.draw.line(rSurface,borderColor,(xCoord_px,0),(xCoord_px,rSurface.get_height()))
-            for y in range(worldChunkSize_ux):
-                if y == 0: borderColor = (255,0,255)
-                else: borderColor = (128,128,128)
-                yCoord_px = y*tileHeight_px
-                pygame.draw.line(rSurface,borderColor,(0,yCoord_px),(rSurface.get_width(),yCoord_px))
-
-        self.good_surfaces[cache_key] = rSurface
-        self.world.markChunkCorrected(modified_key)
-        return RResult(rSurface,RCode.SUCCESS)
+    def _patch_native_tiles(
+            self,
+            rSurface: pygame.Surface,
+            chunk_cx: tuple[int,int,int],
+            tiles: set[tuple[int,int]],
+            ):
+        # redraw only the given cells of an already rasterized chunk surface
+        INSTRUMENTS.count("render.patched_tiles", len(tiles))
+        x_cx, y_cx, z_ux = chunk_cx
+        chunk = self.world.getChunkFromCX((x_cx, y_cx, z_ux // self.world.chunk_size_ux))
+        layerZ_ux = z_ux % self.world.chunk_size_ux
+        tileWidth_px, tileHeight_px = self.tileset[0].get_size()
+        patchBlits = []
+        for x, y in tiles:
+            tileCoords_px = (x*tileWidth_px, y*tileHeight_px)
+            patchBlits.append((self.terrain_tiles[chunk.terrain[layerZ_ux, y, x]], tileCoords_px))
+            cellEntities = chunk.entities.get((x, y, layerZ_ux))
+            if cellEntities:
+                patchBlits.append((self._entity_tile(next(iter(cellEntities))), tileCoords_px))
+        rSurface.blits(patchBlits, doreturn=False)
+
+    def _patch_scaled_tiles(
+            self,
+            rSurface: pygame.Surface,
+            nativeSurface: pygame.Surface,
+            tiles: set[tuple[int,int]],
+            ):
+        nativeWidth_px, nativeHeight_px = self._tile_size(Renderer.NATIVE_ZOOM)
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        for x, y in tiles:
+            nativeTile = nativeSurface.subsurface((x*nativeWidth_px, y*nativeHeight_px, nativeWidth_px, nativeHeight_px))
+            scaledTile = rSurface.subsurface((x*tileWidth_px, y*tileHeight_px, tileWidth_px, tileHeight_px))
+            pygame.transform.scale(nativeTile, scaledTile.get_size(), scaledTile)
+
+    def _scroll_view(
+            self,
+            startChunkX_cx: int,
+            startChunkY_cx: int,
+            chunksWidth_cx: int,
+            chunksHeight_cx: int,
+            z_ux: int,
+            ):
+        # shift the pixels already in the view buffer instead of drawing every chunk again
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        chunkWidth_px = tileWidth_px*self.world.chunk_size_ux
+        chunkHeight_px = tileHeight_px*self.world.chunk_size_ux
+        bufferSize_px = (chunksWidth_cx*chunkWidth_px, chunksHeight_cx*chunkHeight_px)
+
+        if self.view_buffer is None or self.view_buffer.get_size() != bufferSize_px or self.view_origin[2:] != (z_ux, self.zoom):
+            self.view_buffer = pygame.Surface(bufferSize_px)
+            self.view_drawn.clear()
+            self.view_dirty.clear()
+        elif self.view_origin[:2] != (startChunkX_cx, startChunkY_cx):
+            dx_cx = startChunkX_cx - self.view_origin[0]
+            dy_cx = startChunkY_cx - self.view_origin[1]
+            self.view_buffer.scroll(-dx_cx*chunkWidth_px, -dy_cx*chunkHeight_px)
+            chunksWidthRange_cx = range(startChunkX_cx, startChunkX_cx+chunksWidth_cx)
+            chunksHeightRange_cx = range(startChunkY_cx, startChunkY_cx+chunksHeight_cx)
+            self.view_drawn = { # the newly exposed strip is left out, so it gets drawn
+                (cx, cy) for cx, cy in self.view_drawn
+                if cx in chunksWidthRange_cx and cy in chunksHeightRange_cx
+            }
+            self.view_dirty = {slot: tiles for slot, tiles in self.view_dirty.items() if slot in self.view_drawn}
+        self.view_origin = (startChunkX_cx, startChunkY_cx, z_ux, self.zoom)
 
     def _render_chunks(
             self,
@@ -107,82 +304,125 @@ class Renderer:
             z_ux: int,
             ) -> RResult:
 
-        for cx, cy, uz in self.world.modified_chunks:
-            for zoom in self.zoom_scales:
+        for (cx, cy, uz), cells in self.modified_cells.items():
+            for zoom in self.zoom_scales: # other zooms are patched when they are next viewed
                 cache_key = (cx, cy, uz, zoom)
-                if cache_key in self.good_surfaces:
-                    del self.good_surfaces[cache_key]
-                                                           
-        chunkWidth_px = self.tileset[0].get_width()*self.world.chunk_size_ux
-        chunkHeight_px = self.tileset[0].get_width()*self.world.chunk_size_ux
-        surfaceWidth_px = len(chunksWidthRange_chunks)*chunkWidth_px
-        surfaceHeight_px = len(chunksHeightRange_chunks)*chunkHeight_px
-        rSurface = pygame.Surface((surfaceWidth_px,surfaceHeight_px))
+                if cache_key in self.surface_cache:
+                    self.pending_tiles.setdefault(cache_key, set()).update(cells)
+            if uz == z_ux and (cx, cy) in self.view_drawn:
+                self.view_dirty.setdefault((cx, cy), set()).update(cells)
+        self.modified_cells.clear()
+
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        chunkWidth_px = tileWidth_px*self.world.chunk_size_ux
+        chunkHeight_px = tileHeight_px*self.world.chunk_size_ux
+        rSurface = self.view_buffer
 
-        if self.debug_mode:
-            chunksRenderedString = ""
-            chunksRendered = 0
-            chunkCacheHits = 0
-        px,py = 0,0
         for cy in chunksHeightRange_chunks:
             for cx in chunksWidthRange_chunks:
-                chunk = self.world.chunks.get((cx, cy, z_ux // self.world.chunk_size_ux))
-                if chunk:
-                    chunk_cx = (cx,cy,z_ux)
-                    chunkRender = self._render_single_chunk(chunk_cx)
-                    rSurface.blit(chunkRender.surface, (px, py))
-                px += chunkWidth_px
-
-                if chunk and self.debug_mode and chunkRender.code == RCode.SUCCESS:
-                    chunksRenderedString += "R"
-                    chunksRendered += 1
-                elif chunk and self.debug_mode and chunkRender.code == RCode.CACHE_HIT:
-                    chunksRenderedString += "C"
-                    chunkCacheHits += 1
-                elif self.debug_mode:
-                    chunksRenderedString += "X"
-            px = 0
-            py += chunkHeight_px
-
-            if self.debug_mode:
-                chunksRenderedString += "\n"
-
-        if self.debug_mode:
-            topleftChunkCoords_ux = (list(chunksWidthRange_chunks)[0],list(chunksHeightRange_chunks)[0])
-            print(f"rendered chunks (topleft: {topleftChunkCoords_ux}):\n{chunksRenderedString}\nchunks rendered: {chunksRendered}\nsurfaces reused: {chunkCacheHits}")
+                px = (cx - chunksWidthRange_chunks.start)*chunkWidth_px
+                py = (cy - chunksHeightRange_chunks.start)*chunkHeight_px
+                if (cx, cy) in self.view_dirty:
+                    chunkRender = self._render_single_chunk((cx,cy,z_ux)) # patches its tiles into the cached surface
+                    for x, y in self.view_dirty.pop((cx, cy)):
+                        tileRect = pygame.Rect(x*tileWidth_px, y*tileHeight_px, tileWidth_px, tileHeight_px)
+                        rSurface.blit(chunkRender.surface, (px + tileRect.x, py + tileRect.y), tileRect)
+                        if self.debug_mode:
+                            self._draw_tile_grid(rSurface, px + tileRect.x, py + tileRect.y, x, y)
+                elif (cx, cy) not in self.view_drawn and self._fov_active() and not self.fov.chunkVisible((cx, cy, z_ux)):
+                    rSurface.fill((0,0,0), pygame.Rect(px, py, chunkWidth_px, chunkHeight_px)) # drawn once it comes into sight
+                elif (cx, cy) not in self.view_drawn:
+                    chunkKey = (cx, cy, z_ux // self.world.chunk_size_ux)
+                    chunk = self.world.requestChunk(chunkKey)
+                    if chunk:
+                        chunkRender = self._render_single_chunk((cx,cy,z_ux))
+                        rSurface.blit(chunkRender.surface, (px, py))
+                        if self.debug_mode:
+                            self._draw_chunk_grid(rSurface, px, py)
+                        self.view_drawn.add((cx, cy))
+                    elif self.world.inBounds(chunkKey):
+                        rSurface.fill(PLACEHOLDER_COLOR, pygame.Rect(px, py, chunkWidth_px, chunkHeight_px)) # drawn again once loaded
+                    else:
+                        rSurface.fill((0,0,0), pygame.Rect(px, py, chunkWidth_px, chunkHeight_px))
+                        self.view_drawn.add((cx, cy))
+
+        if INSTRUMENTS.enabled:
+            INSTRUMENTS.gauge("cache.hits", self.surface_cache.hits)
+            INSTRUMENTS.gauge("cache.misses", self.surface_cache.misses)
+            INSTRUMENTS.gauge("cache.evictions", self.surface_cache.evictions)
+            INSTRUMENTS.gauge("cache.surfaces", len(self.surface_cache))
+            INSTRUMENTS.gauge("cache.used_MiB", round(self.surface_cache.used_b/2**20, 1))
+            INSTRUMENTS.gauge("recolor.variants", len(self.recolor))
+            if self.fov is not None:
+                INSTRUMENTS.gauge("fov.recomputes", self.fov.recomputes)
 
         return RResult(rSurface,RCode.SUCCESS)
     
+    def _fov_active(self) -> bool:
+        return self.fov is not None and self.fov_enabled
+
+    def _fog(self, clippedRect: pygame.Rect, z_ux: int) -> tuple[pygame.Surface, pygame.Rect]:
+        # one alpha pixel per tile scaled up to tile size, only over the part of the view buffer that is shown
+        tileWidth_px, tileHeight_px = self._tile_size(self.zoom)
+        left_tx, top_tx = clippedRect.left // tileWidth_px, clippedRect.top // tileHeight_px
+        right_tx, bottom_tx = -(-clippedRect.right // tileWidth_px), -(-clippedRect.bottom // tileHeight_px)
+        fogKey = (self.fov.version, self.view_origin, tuple(clippedRect))
+        if fogKey != self.fog_key:
+            viewLeft_ux = self.view_origin[0]*self.world.chunk_size_ux
+            viewTop_ux = self.view_origin[1]*self.world.chunk_size_ux
+            hidden = ~self.fov.region(viewLeft_ux + left_tx, viewTop_ux + top_tx, right_tx - left_tx, bottom_tx - top_tx, z_ux)
+            tileFog = pygame.Surface((right_tx - left_tx, bottom_tx - top_tx), pygame.SRCALPHA)
+            alphas = pygame.surfarray.pixels_alpha(tileFog)
+            alphas[...] = hidden.T * 255 # surfarray is indexed [x, y]
+            del alphas
+            self.fog = pygame.transform.scale(tileFog, ((right_tx - left_tx)*tileWidth_px, (bottom_tx - top_tx)*tileHeight_px))
+            self.fog_key = fogKey
+        return self.fog, pygame.Rect(clippedRect.left - left_tx*tileWidth_px, clippedRect.top - top_tx*tileHeight_px, clippedRect.w, clippedRect.h)
+
+    def _draw_minimap(self, target: pygame.Surface, targetTopleft_px: tuple[int, int], coords: tuple[int, int, int]):
+        panelSide_px = self.minimap.span_cx * self.world.chunk_size_ux * self.minimap.cell_size
+        panelTopleft_px = (targetTopleft_px[0] + self.bounds.w - panelSide_px - MINIMAP_MARGIN_px, targetTopleft_px[1] + MINIMAP_MARGIN_px)
+        panelRect = self.minimap.draw(target, panelTopleft_px, coords, (coords,))
+        pygame.draw.rect(target, MINIMAP_BORDER_COLOR, panelRect.inflate(2, 2), 1)
+
+    def close(self):
+        # stops collecting modified cells, call before dropping a renderer while its world lives on
+        self.world.unwatchModifiedCells(self.modified_cells)
+
+    def toggleMinimap(self):
+        self.minimap_enabled = not self.minimap_enabled
+        INSTRUMENTS.debug("minimap %s", self.minimap_enabled)
+
+    def toggleFieldOfView(self):
+        self.fov_enabled = not self.fov_enabled
+        INSTRUMENTS.debug("field of view %s", self.fov_enabled)
+
     def decrementZoom(self):
          oldZoomScale = self.zoom
          self.zoom = max(self.zoom-1,min(self.zoom_scales))
-         self.tileset = self.tilesets[self.zoom]
-         if self.debug_mode:
-            print(f"zoom changed from {oldZoomScale} to {self.zoom}")
+         INSTRUMENTS.debug("zoom changed from %d to %d", oldZoomScale, self.zoom)
 
     def incrementZoom(self):
          oldZoomScale = self.zoom
          self.zoom = min(self.zoom+1,max(self.zoom_scales))
-         self.tileset = self.tilesets[self.zoom]
-         if self.debug_mode:
-            print(f"zoom changed from {oldZoomScale} to {self.zoom}")
+         INSTRUMENTS.debug("zoom changed from %d to %d", oldZoomScale, self.zoom)
 
     def toggleDebugMode(self):
         if self.debug_mode:
             self.debug_mode = False
         else:
             self.debug_mode = True
-        self.good_surfaces.clear()
-        print(f"grid overlay {self.debug_mode}")
+        self.view_buffer = None # the grid is drawn over the view, cached chunk surfaces stay valid
+        INSTRUMENTS.debug("grid overlay %s, %s", self.debug_mode, self.surface_cache)
     
     def render(
             self,
             coords: tuple[int, int, int],
+            heading: tuple[int, int, int] = (0, 0, 0),
+            target: pygame.Surface = None,
             ) -> pygame.Surface:
-        scaledTileset = self.tilesets[self.zoom]
-
-        scaledTileWidth_px = scaledTileset[0].get_width()
-        scaledTileHeight_px = scaledTileset[0].get_height()
+        # draws straight into target at self.bounds when given, otherwise into a new bounds sized surface
+        scaledTileWidth_px, scaledTileHeight_px = self._tile_size(self.zoom)
 
         scaledChunkWidth_px = self.world.chunk_size_ux * scaledTileWidth_px
         scaledChunkHeight_px = self.world.chunk_size_ux * scaledTileHeight_px
@@ -197,7 +437,13 @@ class Renderer:
         chunksHeightRange_cx = range(startChunkY_cx,chunksHeight_cx+startChunkY_cx)
         z_ux = coords[2]
 
-        chunksSurface = self._render_chunks(chunksWidthRange_cx ,chunksHeightRange_cx,z_ux).surface
+        if self._fov_active():
+            with INSTRUMENTS.timer("render.fov"):
+                self.fov.update(coords)
+        self._scroll_view(startChunkX_cx, startChunkY_cx, chunksWidth_cx, chunksHeight_cx, z_ux)
+        with INSTRUMENTS.timer("render.chunks"):
+            chunksSurface = self._render_chunks(chunksWidthRange_cx ,chunksHeightRange_cx,z_ux).surface
+        self.world.prefetch(chunksWidthRange_cx, chunksHeightRange_cx, z_ux // self.world.chunk_size_ux, heading)
 
         playerX_px = (coords[0] - startChunkX_cx * self.world.chunk_size_ux)*scaledTileWidth_px
         playerY_px = (coords[1] - startChunkY_cx * self.world.chunk_size_ux)*scaledTileHeight_px
@@ -207,9 +453,18 @@ class Renderer:
 
         centeredRect = pygame.Rect(max(0,xOffset_px),max(0,yOffset_px),self.bounds.w,self.bounds.h)
         clippedRect = centeredRect.clip(chunksSurface.get_rect())
-        clippedSurface = chunksSurface.subsurface(clippedRect)
         blitOffset_px = (abs(min(0,xOffset_px)),abs(min(0,yOffset_px)))
 
-        returnSurface = pygame.Surface(self.bounds.size)
-        returnSurface.blit(clippedSurface,blitOffset_px)
-        return returnSurface
\ No newline at end of file
+        if target is None:
+            target = pygame.Surface(self.bounds.size)
+            targetTopleft_px = (0, 0)
+        else:
+            targetTopleft_px = self.bounds.topleft
+        target.blit(chunksSurface,(targetTopleft_px[0]+blitOffset_px[0],targetTopleft_px[1]+blitOffset_px[1]),clippedRect)
+        if self._fov_active():
+            fog, fogArea = self._fog(clippedRect, z_ux)
+            target.blit(fog,(targetTopleft_px[0]+blitOffset_px[0],targetTopleft_px[1]+blitOffset_px[1]),fogArea)
+        if self.minimap is not None and self.minimap_enabled:
+            with INSTRUMENTS.timer("render.minimap"):
+                self._draw_minimap(target, targetTopleft_px, coords)
+        return target
\ No newline at end of file
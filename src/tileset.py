@@ -11,15 +11,3 @@ def load_tileset(path="8x8_ascii.png",dims=(8,8)) -> list:
         for x in range(0,tileset.get_width(),dims[0])
     ]
     return tiles
-
-def generateScaledTilesets(
-        scaleRange: set[int],
-        base_tileset: list[pygame.Surface]
-) -> dict[int,list[pygame.Surface]]:
-    scaled_sets = {}
-    for scale in scaleRange:
-        scaled_sets[scale] = [
-            pygame.transform.scale_by(tile,scale)
-            for tile in base_tileset
-        ]
-    return scaled_sets
\ No newline at end of file
@@ -1,35 +1,76 @@
 import pygame
+from collections import OrderedDict
 
 class textbox:
+    RUN_CACHE_LINES = 256 # rendered lines kept for reuse, a HUD flipping between a few states never re-blits glyphs
+
     def __init__(self,
                  bounds: pygame.rect,
                  content: str,
                  tileset: list[pygame.Surface],
                  ):
-        self.string = content
         self.bounds_rect = bounds
         self.tileset = tileset
         self.surface = pygame.Surface(bounds.size, pygame.SRCALPHA)
-        self._render_text()
+        self.lines = [] # Format: [str] as currently drawn on self.surface
+        self.dirty_lines = set() # Format: {line index} rows of self.surface to redraw before the next draw
+        self.glyph_runs = OrderedDict() # Format: {line text: pygame.Surface} least recently used first
+        self.string = content
 
-    def _render_text(self):
-        self.surface.fill((0,0,0,0))
-        cursor_x, cursor_y = 0,0
-        tile_w, tile_h = self.tileset[0].get_size()
+    @property
+    def string(self) -> str:
+        return "\n".join(self.lines)
+
+    @string.setter
+    def string(self, content: str):
+        self.setLines(content.split("\n"))
 
-        for char in self.string:
-            if char == '\n':
-                cursor_x = 0
-                cursor_y += tile_h
+    def setLines(self, lines: list[str]):
+        # only rows whose text differs are redrawn, rows past the new end are cleared
+        for index in range(max(len(lines), len(self.lines))):
+            oldLine = self.lines[index] if index < len(self.lines) else None
+            newLine = lines[index] if index < len(lines) else None
+            if oldLine != newLine:
+                self.dirty_lines.add(index)
+        self.lines = list(lines)
 
-            tile_index = ord(char) - 32
-            if 0 <= tile_index < len(self.tileset):
-                self.surface.blit(self.tileset[tile_index], (cursor_x,cursor_y))
-                cursor_x += tile_w
+    def setLine(self, index: int, line: str):
+        if index >= len(self.lines):
+            self.lines.extend([""] * (index + 1 - len(self.lines)))
+        if self.lines[index] != line:
+            self.lines[index] = line
+            self.dirty_lines.add(index)
+
+    def _glyph_run(self, line: str) -> pygame.Surface:
+        run = self.glyph_runs.get(line)
+        if run is not None:
+            self.glyph_runs.move_to_end(line)
+            return run
+        tile_w, tile_h = self.tileset[0].get_size()
+        glyphs = [self.tileset[ord(char) - 32] for char in line if 0 <= ord(char) - 32 < len(self.tileset)]
+        run = pygame.Surface((max(1, len(glyphs)*tile_w), tile_h), pygame.SRCALPHA)
+        run.blits([(glyph, (i*tile_w, 0)) for i, glyph in enumerate(glyphs)], doreturn=False)
+        self.glyph_runs[line] = run
+        if len(self.glyph_runs) > textbox.RUN_CACHE_LINES:
+            self.glyph_runs.popitem(last=False)
+        return run
+
+    def _render_text(self):
+        tile_h = self.tileset[0].get_height()
+        runBlits = []
+        for index in sorted(self.dirty_lines):
+            rowRect = pygame.Rect(0, index*tile_h, self.surface.get_width(), tile_h)
+            if rowRect.top >= self.surface.get_height():
+                break
+            self.surface.fill((0,0,0,0), rowRect)
+            if index < len(self.lines) and self.lines[index]:
+                runBlits.append((self._glyph_run(self.lines[index]), rowRect.topleft))
+        if runBlits:
+            self.surface.blits(runBlits, doreturn=False)
+        self.dirty_lines.clear()
 
     def draw(self, target_surface: pygame.Surface):
-        self._render_text()
+        if self.dirty_lines:
+            self._render_text()
         target_surface.blit(self.surface,self.bounds_rect.topleft)
         return self.surface
-
-
@@ -0,0 +1,43 @@
+import numpy
+
+# chunks are a pure function of (seed, chunk coords) so untouched chunks never have to be saved
+# every stage works on whole chunk arrays at once, indexed [z, y, x] like Chunk
+
+_MASK64 = 0xFFFFFFFFFFFFFFFF
+
+def _mix(values: numpy.ndarray) -> numpy.ndarray:
+    # splitmix64 finalizer, uint64 arithmetic wraps so no overflow handling is needed
+    values = values ^ (values >> numpy.uint64(30))
+    values = values * numpy.uint64(0xBF58476D1CE4E5B9)
+    values = values ^ (values >> numpy.uint64(27))
+    values = values * numpy.uint64(0x94D049BB133111EB)
+    return values ^ (values >> numpy.uint64(31))
+
+def cellHashes(seed: int, stage: int, coords_cx: tuple[int, int, int], sideLength_ux: int) -> numpy.ndarray:
+    # one 64 bit hash per cell of the chunk, different for every seed, stage and world cell
+    axis = numpy.arange(sideLength_ux, dtype=numpy.int64)
+    x = (axis + coords_cx[0] * sideLength_ux).astype(numpy.uint64)[numpy.newaxis, numpy.newaxis, :]
+    y = (axis + coords_cx[1] * sideLength_ux).astype(numpy.uint64)[numpy.newaxis, :, numpy.newaxis]
+    z = (axis + coords_cx[2] * sideLength_ux).astype(numpy.uint64)[:, numpy.newaxis, numpy.newaxis]
+    key = numpy.uint64((seed * 0x9E3779B97F4A7C15 + stage * 0xD1B54A32D192ED03) & _MASK64)
+    return _mix(_mix(x ^ key) ^ (y * numpy.uint64(0x85EBCA77C2B2AE63)) ^ (z * numpy.uint64(0xC2B2AE3D27D4EB4F)))
+
+def scatterGrass(seed, coords_cx, terrain, passable):
+    # terrain 1 and 2 are the two grass tiles, picked evenly like the old random fill
+    hashes = cellHashes(seed, 0, coords_cx, terrain.shape[0])
+    terrain[...] = 1 + (hashes & numpy.uint64(1))
+
+STAGES = [scatterGrass] # run in order, each one refines the arrays left by the previous
+
+def generateChunk(
+        seed: int,
+        coords_cx: tuple[int, int, int],
+        sideLength_ux: int,
+        terrainDtype=numpy.uint8,
+        ) -> tuple[numpy.ndarray, numpy.ndarray]:
+    shape = (sideLength_ux, sideLength_ux, sideLength_ux)
+    terrain = numpy.ones(shape, dtype=terrainDtype)
+    passable = numpy.ones(shape, dtype=numpy.bool_)
+    for stage in STAGES:
+        stage(seed, coords_cx, terrain, passable)
+    return terrain, passable